@@ -8,27 +8,60 @@ import io
 db = SQLAlchemy()
 
 
-def create_app():
-    app = Flask(__name__)
-
+def database_uri():
     # Use absolute paths for the database
     db_path = os.environ.get("DATABASE_PATH", "/app/data/bbq_sessions.db")
 
     # Make sure parent directory exists
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    return f"sqlite:///{db_path}"
+
+
+def migrate_database(engine):
+    """Create or upgrade the schema (shared with the MQTT listener)"""
+    from app.migrations import run_migrations
+
+    print(f"Using database at: {engine.url.database}")
+    try:
+        run_migrations(engine)
+        print("Database initialized successfully")
+    except Exception as e:
+        print(f"Error initializing database: {e}")
+        import traceback
+
+        traceback.print_exc()
+
+
+def create_app():
+    app = Flask(__name__)
 
-    print(f"Using database at: {db_path}")
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri()
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-key-for-smokenotes")
+    # Largest CSV upload; the request cap leaves room for the other form fields
+    app.config["CSV_UPLOAD_MAX_MB"] = float(os.environ.get("CSV_UPLOAD_MAX_MB", "100"))
+    app.config["MAX_CONTENT_LENGTH"] = int((app.config["CSV_UPLOAD_MAX_MB"] + 1) * 1024 * 1024)
 
     db.init_app(app)
 
+    # WAL, busy timeout and cache pragmas on every pooled connection
+    from app.sqlite_utils import configure_sqlite_engine
+
+    with app.app_context():
+        configure_sqlite_engine(db.engine)
+
     # Register blueprints
     from app.routes import main
 
     app.register_blueprint(main)
 
+    # flask archive-cooks, flask maintenance
+    from app.archive import archive_cooks_command
+    from app.maintenance import maintenance_command
+
+    app.cli.add_command(archive_cooks_command)
+    app.cli.add_command(maintenance_command)
+
     # Add custom filter for newlines
     @app.template_filter("nl2br")
     def nl2br_filter(s):
@@ -36,15 +69,22 @@ def create_app():
             return s.replace("\n", "<br>")
         return s
 
-    # Create database if it doesn't exist
-    with app.app_context():
-        try:
-            db.create_all()
-            print("Database initialized successfully")
-        except Exception as e:
-            print(f"Error initializing database: {e}")
-            import traceback
-
-            traceback.print_exc()
+    # Under gunicorn the master has already migrated (gunicorn.conf.py), so
+    # workers skip it; flask run and the CLI migrate here
+    if not os.environ.get("SCHEMA_MIGRATED"):
+        with app.app_context():
+            migrate_database(db.engine)
+
+    # Optional periodic maintenance (MAINTENANCE_INTERVAL_HOURS)
+    from app.maintenance import start_maintenance_thread
+
+    start_maintenance_thread(app)
+
+    # CSV uploads are processed by a job thread in each web worker
+    from app.upload_jobs import ensure_upload_worker
+
+    @app.before_request
+    def start_upload_worker():
+        ensure_upload_worker(app)
 
     return app
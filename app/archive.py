@@ -0,0 +1,294 @@
+"""
+Packed archive of temperature_log for completed sessions
+
+Once a session has ended its log never changes, so it is moved out of
+temperature_log into a single temperature_archive row: microsecond timestamps
+delta-encoded as int64, cook ids as int64 and each channel as int32 hundredths,
+zlib-compressed together. Reads decode straight into NumPy arrays.
+
+Rows the listener writes after a session was archived stay in temperature_log
+until the session is archived again, so readers always merge the two.
+"""
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, text
+
+from app.rollups import ROLLUP_CHANNELS
+
+# Same attributes as TemperatureLog, so graph and export code can take either
+LogPoint = namedtuple("LogPoint", ("timestamp", "cook_id") + ROLLUP_CHANNELS)
+
+ARCHIVE_MAGIC = b"SNLA"
+ARCHIVE_VERSION = 1
+# magic, version, row count, first timestamp (µs since the epoch)
+_HEADER = struct.Struct("<4sBIq")
+
+# Channels are stored as fixed-point hundredths; blower is the only one with
+# fractional values and the listener keeps two decimals of it
+CHANNEL_SCALE = 100
+# NULL markers: the smallest int32 and int64
+_MISSING_CHANNEL = -(2**31)
+_MISSING_COOK = -(2**63)
+
+
+def pack_log(columns):
+    """Pack decoded log columns (as returned by unpack_log) into an archive blob"""
+    import numpy as np
+
+    micros = columns["timestamp"].astype("datetime64[us]").astype(np.int64)
+    rows = len(micros)
+    first = int(micros[0]) if rows else 0
+    deltas = np.diff(micros, prepend=first)
+
+    cook_ids = np.where(
+        np.isnan(columns["cook_id"]), _MISSING_COOK, np.nan_to_num(columns["cook_id"])
+    ).astype("<i8")
+    parts = [deltas.astype("<i8").tobytes(), cook_ids.tobytes()]
+    for channel in ROLLUP_CHANNELS:
+        values = columns[channel]
+        fixed = np.where(
+            np.isnan(values),
+            _MISSING_CHANNEL,
+            np.round(np.nan_to_num(values) * CHANNEL_SCALE),
+        ).astype("<i4")
+        parts.append(fixed.tobytes())
+
+    header = _HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, rows, first)
+    return header + zlib.compress(b"".join(parts))
+
+
+def unpack_log(blob):
+    """Decode an archive blob into a dict of NumPy arrays.
+
+    timestamp is datetime64[us] (UTC), cook_id and the channels are float64
+    with NaN where the original value was NULL.
+    """
+    import numpy as np
+
+    magic, version, rows, first = _HEADER.unpack_from(blob)
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported temperature archive (version {version})")
+    payload = zlib.decompress(blob[_HEADER.size:])
+
+    offset = 0
+
+    def take(dtype):
+        nonlocal offset
+        array = np.frombuffer(payload, dtype=dtype, count=rows, offset=offset)
+        offset += array.nbytes
+        return array
+
+    micros = np.cumsum(take("<i8")) + first
+    columns = {"timestamp": micros.astype("datetime64[us]")}
+    cook_ids = take("<i8")
+    columns["cook_id"] = np.where(cook_ids == _MISSING_COOK, np.nan, cook_ids)
+    for channel in ROLLUP_CHANNELS:
+        fixed = take("<i4")
+        columns[channel] = np.where(
+            fixed == _MISSING_CHANNEL, np.nan, fixed / CHANNEL_SCALE
+        )
+    return columns
+
+
+def raw_log_sql(after_id=False, through_id=False):
+    """SQL reading a session's raw log rows; parameters are the session id,
+    then after_id and through_id when given.
+
+    Without after_id the rows come straight off the covering
+    ix_temperature_log_session_time (query_plan_check.py guards this); with
+    after_id they are found by rowid, which stays cheap however long the
+    session is.
+    """
+    sql = "SELECT timestamp, cook_id, set_temp, pit_temp, meat_temp1, blower FROM temperature_log"
+    if after_id:
+        sql += " NOT INDEXED WHERE session_id = ? AND id > ?"
+    else:
+        sql += " WHERE session_id = ?"
+    if through_id:
+        sql += " AND id <= ?"
+    return sql
+
+
+def _raw_columns(session_id, after_id=None, through_id=None):
+    """Read a session's unarchived temperature_log rows as NumPy columns.
+
+    after_id and through_id limit the read to an id range.
+    """
+    import numpy as np
+    import pandas as pd
+    from app import db
+
+    sql = raw_log_sql(after_id is not None, through_id is not None)
+    params = [session_id]
+    if after_id is not None:
+        params.append(after_id)
+    if through_id is not None:
+        params.append(through_id)
+
+    # Plain tuples off the sqlite3 cursor: building ORM objects, or even
+    # SQLAlchemy Row wrappers, costs more than the read itself
+    cursor = db.session.connection().connection.cursor()
+    try:
+        rows = cursor.execute(sql, tuple(params)).fetchall()
+    finally:
+        cursor.close()
+    frame = pd.DataFrame(rows, columns=("timestamp", "cook_id") + ROLLUP_CHANNELS)
+    columns = {
+        "timestamp": pd.to_datetime(frame["timestamp"], format="ISO8601", utc=True)
+        .dt.tz_localize(None)
+        .to_numpy(dtype="datetime64[us]")
+    }
+    for name in ("cook_id",) + ROLLUP_CHANNELS:
+        columns[name] = pd.to_numeric(frame[name]).to_numpy(dtype=np.float64)
+    return columns
+
+
+def load_log_columns(session_id, through_id=None):
+    """Return a session's full log, archived and raw, as time-ordered NumPy columns.
+
+    through_id leaves out raw rows written after that id.
+    """
+    import numpy as np
+    from app.models import TemperatureArchive
+
+    parts = []
+    archive = TemperatureArchive.query.get(session_id)
+    if archive is not None:
+        parts.append(unpack_log(archive.data))
+    raw = _raw_columns(session_id, through_id=through_id)
+    if len(raw["timestamp"]) or not parts:
+        parts.append(raw)
+    if len(parts) == 1:
+        return parts[0]
+
+    columns = {
+        name: np.concatenate([part[name] for part in parts]) for name in parts[0]
+    }
+    order = np.argsort(columns["timestamp"], kind="stable")
+    return {name: values[order] for name, values in columns.items()}
+
+
+def new_log_columns(session_id, after_id, through_id=None):
+    """Raw rows with after_id < id <= through_id, as time-ordered NumPy columns"""
+    import numpy as np
+
+    columns = _raw_columns(session_id, after_id=after_id, through_id=through_id)
+    order = np.argsort(columns["timestamp"], kind="stable")
+    return {name: values[order] for name, values in columns.items()}
+
+
+def columns_to_points(columns):
+    """Convert NumPy log columns to LogPoints with naive UTC datetimes"""
+    names = ("cook_id",) + ROLLUP_CHANNELS
+    values = [
+        [None if value != value else value for value in columns[name].tolist()]
+        for name in names
+    ]
+    cook_ids = [None if value is None else int(value) for value in values[0]]
+    return [
+        LogPoint(*row)
+        for row in zip(columns["timestamp"].tolist(), cook_ids, *values[1:])
+    ]
+
+
+def session_log(session_id):
+    """Return a session's full log as LogPoints, ordered by time"""
+    return columns_to_points(load_log_columns(session_id))
+
+
+def log_row_count(session_id):
+    """Number of log readings for a session, archived and raw"""
+    from app.models import TemperatureArchive, TemperatureLog
+
+    archive = TemperatureArchive.query.get(session_id)
+    archived = archive.rows if archive is not None else 0
+    return archived + TemperatureLog.query.filter_by(session_id=session_id).count()
+
+
+def archive_session(session_id):
+    """Pack a completed session's log into temperature_archive.
+
+    Merges with any existing archive, so it is safe to run again after late
+    readings arrive. Returns the number of raw rows moved, or 0 if there was
+    nothing to do.
+    """
+    from app import db
+    from app.models import BBQSession, TemperatureArchive, TemperatureLog
+
+    session = BBQSession.query.get(session_id)
+    if session is None or session.end_time is None:
+        return 0
+    # The listener may still be writing late readings; pack and delete only
+    # the rows up to this id, and leave newer ones for the next run
+    max_id, moved = (
+        db.session.query(func.max(TemperatureLog.id), func.count(TemperatureLog.id))
+        .filter(TemperatureLog.session_id == session_id)
+        .one()
+    )
+    if not moved:
+        return 0
+
+    columns = load_log_columns(session_id, through_id=max_id)
+    timestamps = columns["timestamp"].tolist()
+    archive = TemperatureArchive.query.get(session_id)
+    if archive is None:
+        archive = TemperatureArchive(session_id=session_id)
+        db.session.add(archive)
+    archive.rows = len(timestamps)
+    archive.first_timestamp = timestamps[0]
+    archive.last_timestamp = timestamps[-1]
+    archive.data = pack_log(columns)
+    archive.archived_at = datetime.now(timezone.utc)
+    TemperatureLog.query.filter(
+        TemperatureLog.session_id == session_id, TemperatureLog.id <= max_id
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return moved
+
+
+def archive_completed_sessions():
+    """Archive every completed session that still has raw log rows.
+
+    Returns (sessions, rows moved). Each session is its own transaction, so
+    the write lock is only held briefly at a time.
+    """
+    from app import db
+    from app.models import BBQSession, TemperatureLog
+
+    session_ids = [
+        session_id
+        for (session_id,) in db.session.query(BBQSession.id)
+        .filter(BBQSession.end_time.isnot(None))
+        .filter(
+            db.session.query(TemperatureLog.id)
+            .filter(TemperatureLog.session_id == BBQSession.id)
+            .exists()
+        )
+        .all()
+    ]
+    moved = 0
+    for session_id in session_ids:
+        moved += archive_session(session_id)
+    return len(session_ids), moved
+
+
+@click.command("archive-cooks")
+@click.option("--vacuum", is_flag=True, help="VACUUM afterwards to return freed pages to disk.")
+@with_appcontext
+def archive_cooks_command(vacuum):
+    """Pack the logs of all completed sessions into temperature_archive."""
+    from app import db
+
+    sessions, moved = archive_completed_sessions()
+    click.echo(f"Archived {sessions} sessions ({moved} log rows)")
+
+    if vacuum:
+        # VACUUM cannot run inside a transaction
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+        click.echo("Database vacuumed")
@@ -0,0 +1,58 @@
+"""
+Content-addressed on-disk store for uploaded graph images
+
+Blobs are named by their SHA-256 and kept next to the database under
+GRAPH_BLOB_PATH, so identical uploads share one file and the PNGs stay out of
+the SQLite file the listener writes to. app/migrations.py uses the same
+layout when it moves existing Graph.image_data blobs out.
+"""
+import hashlib
+import os
+import tempfile
+
+
+def blob_root():
+    database_path = os.environ.get("DATABASE_PATH", "/app/data/bbq_sessions.db")
+    return os.environ.get(
+        "GRAPH_BLOB_PATH", os.path.join(os.path.dirname(database_path), "graphs")
+    )
+
+
+def blob_path(digest):
+    return os.path.join(blob_root(), digest[:2], digest)
+
+
+def put_blob(data):
+    """Store data and return its SHA-256 hex digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if os.path.exists(path):
+        return digest
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file and rename so readers never see a partial blob
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as blob:
+            blob.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return digest
+
+
+def prune_blobs(digests):
+    """Delete the given blobs unless a Graph or GraphVariant still refers to them"""
+    from app.models import Graph, GraphVariant
+
+    for digest in set(filter(None, digests)):
+        if (
+            Graph.query.filter_by(blob_sha256=digest).first() is None
+            and GraphVariant.query.filter_by(blob_sha256=digest).first() is None
+            and GraphVariant.query.filter_by(png_sha256=digest).first() is None
+        ):
+            try:
+                os.unlink(blob_path(digest))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,198 @@
+"""
+Import uploaded FlameBoss CSV exports into temperature_log
+
+Uploads are copied to a temporary file in chunks and parsed CSV_CHUNK_ROWS
+rows at a time, reading only the FlameBoss columns as float32, so a
+multi-day export never sits in memory whole. Each chunk is vectorized with
+pandas and inserted with one executemany, all in a single transaction, so it
+lands in the same table (and the same rollups, archive and graph paths) as a
+live MQTT cook.
+"""
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from app.rollups import ROLLUP_CHANNELS, ROLLUP_UPSERT_SQL, aggregate_rollups_frame
+
+# FlameBoss marks an unplugged probe with this raw value
+MISSING_PROBE = -32767
+
+# The columns read from an export; anything else in the file is skipped
+FLAMEBOSS_COLUMNS = ("time", "set_temp", "pit_temp", "meat_temp1", "duty_cycle")
+# Raw readings are small integers, exact in float32
+_FLAMEBOSS_DTYPES = {"time": "float64"} | {
+    column: "float32" for column in FLAMEBOSS_COLUMNS[1:]
+}
+
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", "50000"))
+
+# Same storage format SQLAlchemy's SQLite DateTime uses
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_INSERT_SQL = (
+    "INSERT INTO temperature_log "
+    "(cook_id, session_id, timestamp, set_temp, pit_temp, meat_temp1, blower) "
+    "VALUES (NULL, ?, ?, ?, ?, ?, ?)"
+)
+_BUMP_LOG_VERSION_SQL = "UPDATE bbq_session SET log_version = log_version + 1 WHERE id = ?"
+
+
+def save_upload(stream, max_bytes, chunk_size=1024 * 1024, directory=None):
+    """Copy an uploaded file to a temporary file a chunk at a time.
+
+    The file goes in directory (the system temp directory by default).
+    Returns the path; the caller removes it. Raises ValueError once more
+    than max_bytes have been read.
+    """
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as upload:
+            size = 0
+            while chunk := stream.read(chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(
+                        f"CSV is larger than {max_bytes // (1024 * 1024)} MB"
+                    )
+                upload.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _open_csv(source):
+    """pandas input for a CSV given as bytes or a path"""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def is_flameboss_csv(source):
+    """Whether the CSV's header has FlameBoss's time column and a reading column"""
+    with open(source, "rb") if isinstance(source, str) else io.BytesIO(source) as csv:
+        header = csv.readline().decode("utf-8", errors="replace")
+    columns = {column.strip() for column in header.split(",")}
+    return "time" in columns and bool(columns & set(FLAMEBOSS_COLUMNS[1:]))
+
+
+def iter_flameboss_csv(source, chunk_rows=None):
+    """Parse a FlameBoss CSV export into DataFrames of log readings.
+
+    Yields up to chunk_rows (default CSV_CHUNK_ROWS) readings at a time, each
+    chunk sorted by time. Applies the same scaling as generate_graph_from_csv:
+    temperatures / 5, duty cycle / 100 (stored as blower). Timestamps are
+    naive UTC.
+    """
+    chunks = pd.read_csv(
+        _open_csv(source),
+        usecols=lambda column: column in FLAMEBOSS_COLUMNS,
+        dtype=_FLAMEBOSS_DTYPES,
+        chunksize=chunk_rows or CSV_CHUNK_ROWS,
+    )
+    for data in chunks:
+        if "time" not in data.columns:
+            raise ValueError("CSV has no 'time' column")
+
+        frame = pd.DataFrame({"timestamp": pd.to_datetime(data["time"], unit="s")})
+        # Scale in float64 so stored values match a live cook's exactly
+        for column in ("set_temp", "pit_temp", "meat_temp1"):
+            if column in data.columns:
+                raw = data[column].astype(np.float64)
+                frame[column] = raw.where(raw != MISSING_PROBE) / 5
+            else:
+                frame[column] = np.nan
+        if "duty_cycle" in data.columns:
+            frame["blower"] = data["duty_cycle"].astype(np.float64) / 100
+        else:
+            frame["blower"] = np.nan
+
+        yield frame.dropna(subset=["timestamp"]).sort_values("timestamp", kind="stable")
+
+
+def parse_flameboss_csv(source):
+    """The whole of iter_flameboss_csv as one DataFrame sorted by time"""
+    frame = pd.concat(list(iter_flameboss_csv(source)), ignore_index=True)
+    return frame.sort_values("timestamp", kind="stable")
+
+
+def _sorted_contains(sorted_values, values):
+    """Mask of values already present in the sorted array sorted_values"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+def _insert_params(frame, session_id):
+    # Positional tuples straight to the driver; SQLAlchemy's per-row
+    # parameter processing dominates at this size
+    channels = [
+        np.where(frame[channel].isna(), None, frame[channel].to_numpy(dtype=object)).tolist()
+        for channel in ROLLUP_CHANNELS
+    ]
+    return list(
+        zip(
+            [session_id] * len(frame),
+            frame["timestamp"].dt.strftime(_TIMESTAMP_FORMAT).tolist(),
+            *channels,
+        )
+    )
+
+
+def import_csv_log(session_id, source):
+    """Bulk-insert a FlameBoss CSV (bytes or a path) into a session's temperature_log.
+
+    Readings at timestamps the session already has are skipped, so uploading
+    the same file twice is harmless. Rollups are updated in the same
+    transaction and completed sessions are re-archived. Returns the number of
+    rows imported.
+    """
+    from app import db
+    from app.archive import archive_session, load_log_columns
+    from app.models import BBQSession, TemperatureRollup
+
+    existing = load_log_columns(session_id)["timestamp"]
+
+    # A session with log rows but no rollups yet is backfilled on first read;
+    # rolling up only the imported rows would leave it half done
+    update_rollups = (
+        not len(existing)
+        or TemperatureRollup.query.filter_by(session_id=session_id).first() is not None
+    )
+
+    imported = 0
+    # Timestamps the session has, kept sorted; chunks usually just append
+    seen = existing.astype("datetime64[us]")
+    try:
+        connection = db.session.connection()
+        for frame in iter_flameboss_csv(source):
+            stamps = frame["timestamp"].to_numpy(dtype="datetime64[us]")
+            frame = frame[~_sorted_contains(seen, stamps)].drop_duplicates(subset="timestamp")
+            if frame.empty:
+                continue
+            added = frame["timestamp"].to_numpy(dtype="datetime64[us]")
+            seen = np.concatenate([seen, added])
+            if len(seen) > len(added) and added[0] < seen[-len(added) - 1]:
+                seen.sort(kind="stable")
+
+            connection.exec_driver_sql(_INSERT_SQL, _insert_params(frame, session_id))
+            if update_rollups:
+                db.session.execute(
+                    ROLLUP_UPSERT_SQL, aggregate_rollups_frame(frame, session_id)
+                )
+            imported += len(frame)
+        if imported:
+            # Invalidates cached graphs even when every row is older than the newest
+            connection.exec_driver_sql(_BUMP_LOG_VERSION_SQL, (session_id,))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if not imported:
+        return 0
+
+    session = BBQSession.query.get(session_id)
+    if session is not None and session.end_time is not None:
+        archive_session(session_id)
+    return imported
@@ -6,16 +6,58 @@ import io
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-
-def generate_graph_from_csv(
-    file_content, timezone="UTC", tick_interval_minutes=15
-):
-    if timezone is None:
-        timezone = "UTC"  # or call get_timezone() if available
-    """Generate a graph from CSV data and return the image bytes"""
-
+from app.lttb import lttb_rows
+
+# Tick spacings to widen to when the requested one would crowd the axis;
+# every tick costs a rendered label, and a multi-day cook at 15 minutes
+# has over a thousand
+MAX_TIME_TICKS = 60
+_TICK_STEPS_MINUTES = (15, 30, 60, 120, 180, 360, 720, 1440)
+
+# Let Agg rasterize long lines in pieces; unbounded, one dense series holds
+# ~100 MiB of path state during savefig
+plt.rcParams["agg.path.chunksize"] = 500
+
+
+def _time_locator(span_seconds, tick_interval_minutes):
+    """Ticks every tick_interval_minutes, or the next wider step that fits MAX_TIME_TICKS"""
+    span_minutes = span_seconds / 60
+    for step in (tick_interval_minutes,) + _TICK_STEPS_MINUTES:
+        if step >= tick_interval_minutes and span_minutes / step <= MAX_TIME_TICKS:
+            return mdates.MinuteLocator(interval=step)
+    return mdates.DayLocator(interval=int(span_minutes // (MAX_TIME_TICKS * 1440)) + 1)
+
+
+def _read_flameboss_for_plot(source, timezone, point_budget):
+    """Stream a FlameBoss export, keeping only each chunk's LTTB points"""
+    from app.csv_import import iter_flameboss_csv
+
+    parts = []
+    for chunk in iter_flameboss_csv(source):
+        keep = lttb_rows(
+            chunk["timestamp"].astype("int64").to_numpy() / 1e9,
+            [chunk[col].to_numpy(dtype=float) for col in chunk.columns[1:]],
+            point_budget,
+        )
+        parts.append(chunk.iloc[keep])
+    if not parts:
+        raise ValueError("CSV has no readings")
+    data = pd.concat(parts, ignore_index=True).sort_values("timestamp", kind="stable")
+    data = data.rename(columns={"blower": "duty_cycle"})
+    data["timestamp"] = data["timestamp"].dt.tz_localize("UTC").dt.tz_convert(timezone)
+
+    # Already scaled; plot only the probes the export has readings for
+    temp_columns = [
+        col for col in ["set_temp", "pit_temp", "meat_temp1"] if data[col].notna().any()
+    ]
+    duty_column = "duty_cycle" if data["duty_cycle"].notna().any() else None
+    return data, temp_columns, duty_column
+
+
+def _read_other_csv_for_plot(source, timezone):
+    """Read a CSV that is not a FlameBoss export whole, guessing at its columns"""
     # Create a file-like object from the content
-    csv_io = io.StringIO(file_content.decode("utf-8"))
+    csv_io = io.BytesIO(source) if isinstance(source, bytes) else source
 
     # Load data
     data = pd.read_csv(csv_io)
@@ -39,41 +81,60 @@ def generate_graph_from_csv(
                 end=current_time, periods=len(data), freq="T"
             ).tz_localize(timezone)
 
+    # Determine which columns to plot
+    temp_columns = []
+    duty_column = None
+
+    # Look for temp in column names
+    for col in data.columns:
+        if "temp" in col.lower() and col != "timestamp":
+            temp_columns.append(col)
+        elif "duty" in col.lower() or "cycle" in col.lower():
+            duty_column = col
+            # Scale duty if not already scaled (assuming percentage 0-100)
+            if data[duty_column].max() > 1.0:
+                data[duty_column] = data[duty_column] / 100
+    return data, temp_columns, duty_column
+
+
+def generate_graph_from_csv(
+    file_content, timezone="UTC", tick_interval_minutes=15, point_budget=None
+):
+    if timezone is None:
+        timezone = "UTC"  # or call get_timezone() if available
+    """Generate a graph from CSV data (bytes or a file path) and return the image bytes
+
+    FlameBoss exports are streamed in chunks and reduced to point_budget
+    (default GRAPH_POINT_BUDGET) as they are read, so memory stays flat
+    however long the cook was.
+    """
+    from app.csv_import import is_flameboss_csv
+
+    if is_flameboss_csv(file_content):
+        data, temp_columns, duty_column = _read_flameboss_for_plot(
+            file_content, timezone, point_budget
+        )
+    else:
+        data, temp_columns, duty_column = _read_other_csv_for_plot(file_content, timezone)
+
     # Calculate total elapsed time
     elapsed = data["timestamp"].iloc[-1] - data["timestamp"].iloc[0]
     total_hours, remainder = divmod(elapsed.total_seconds(), 3600)
     total_minutes = remainder // 60
     elapsed_str = f"{int(total_hours)}h {int(total_minutes)}m"
 
-    # Determine which columns to plot
-    temp_columns = []
-    duty_column = None
-
-    # Scale temperature readings if they exist
-    for col_name in ["set_temp", "pit_temp", "meat_temp1"]:
-        if col_name in data.columns:
-            data[col_name] = data[col_name] / 5
-            temp_columns.append(col_name)
-
-    # Scale duty cycle reading if it exists
-    if "duty_cycle" in data.columns:
-        data["duty_cycle"] = data["duty_cycle"] / 100
-        duty_column = "duty_cycle"
-
-    # If we didn't find expected columns, look for temp in column names
-    if not temp_columns:
-        for col in data.columns:
-            if "temp" in col.lower() and col != "timestamp":
-                temp_columns.append(col)
-            elif "duty" in col.lower() or "cycle" in col.lower():
-                duty_column = col
-                # Scale duty if not already scaled (assuming percentage 0-100)
-                if data[duty_column].max() > 1.0:
-                    data[duty_column] = data[duty_column] / 100
-
     # Extract the date for title
     graph_date = data["timestamp"].dt.date.iloc[0]
 
+    # No more points than the image can show
+    plotted = temp_columns + ([duty_column] if duty_column else [])
+    keep = lttb_rows(
+        data["timestamp"].astype("int64").to_numpy() / 1e9,
+        [pd.to_numeric(data[col], errors="coerce").to_numpy(dtype=float) for col in plotted],
+        point_budget,
+    )
+    data = data.iloc[keep]
+
     # Plotting
     fig, ax = plt.subplots(figsize=(16, 9))
 
@@ -114,7 +175,7 @@ def generate_graph_from_csv(
     ax.xaxis.set_major_formatter(local_formatter)
 
     # Set ticks every N minutes
-    locator = mdates.MinuteLocator(interval=tick_interval_minutes)
+    locator = _time_locator(elapsed.total_seconds(), tick_interval_minutes)
     ax.xaxis.set_major_locator(locator)
 
     # Set y-axis to 25°F increments
@@ -136,9 +197,17 @@ def generate_graph_from_csv(
 
 
 def generate_graph_from_db(
-    temp_logs, timezone="UTC", tick_interval_minutes=15
+    temp_logs, timezone="UTC", tick_interval_minutes=15, steps=False, point_budget=None
 ):
-    """Generate a graph from TemperatureLog data and return the image bytes"""
+    """Generate a graph from TemperatureLog data and return the image bytes
+
+    temp_logs is either a dict of column arrays (as returned by
+    load_series_columns) or an iterable of TemperatureLog-like rows. With
+    steps=True each reading is held until the next one, which is how rows
+    stored in the listener's deadband mode should be read. Series longer
+    than point_budget (default GRAPH_POINT_BUDGET) are reduced with LTTB
+    before plotting.
+    """
     import pandas as pd
     import matplotlib.pyplot as plt
     import matplotlib.dates as mdates
@@ -147,21 +216,20 @@ def generate_graph_from_db(
     from zoneinfo import ZoneInfo
     from datetime import datetime
 
-    # Convert temperature logs to pandas DataFrame
-    data = []
-    for log in temp_logs:
-        data.append(
-            {
-                "timestamp": log.timestamp,
-                "set_temp": log.set_temp,
-                "pit_temp": log.pit_temp,
-                "meat_temp1": log.meat_temp1,
-                "blower": log.blower,  # Using blower instead of duty_cycle
-            }
-        )
+    # Using blower instead of duty_cycle
+    columns = ["timestamp", "set_temp", "pit_temp", "meat_temp1", "blower"]
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+    # Columns go straight into the DataFrame; rows are read attribute-wise once
+    if isinstance(temp_logs, dict):
+        df = pd.DataFrame({column: temp_logs[column] for column in columns})
+    else:
+        df = pd.DataFrame.from_records(
+            (
+                (log.timestamp, log.set_temp, log.pit_temp, log.meat_temp1, log.blower)
+                for log in temp_logs
+            ),
+            columns=columns,
+        )
 
     # Skip if no data
     if df.empty:
@@ -182,14 +250,24 @@ def generate_graph_from_db(
         plt.close(fig)
         return buf.read()
 
-    # Make sure timestamp is timezone aware - assume UTC if naive
-    if not df.empty and df["timestamp"].iloc[0].tzinfo is None:
-        df["timestamp"] = df["timestamp"].apply(lambda dt: dt.replace(tzinfo=ZoneInfo("UTC")))
-
-    # Convert to user's timezone
-    if not df.empty:
-        user_tz = ZoneInfo(timezone)
-        df["timestamp"] = df["timestamp"].apply(lambda dt: dt.astimezone(user_tz))
+    # Make sure timestamp is timezone aware - assume UTC if naive - then
+    # convert to the user's timezone, as whole-column operations
+    timestamps = pd.to_datetime(df["timestamp"], utc=False)
+    if timestamps.dt.tz is None:
+        timestamps = timestamps.dt.tz_localize("UTC")
+    df["timestamp"] = timestamps.dt.tz_convert(timezone)
+
+    # Matplotlib date numbers computed once from the UTC values; handing it
+    # tz-aware timestamps makes every plot() call convert them row by row.
+    # The formatter below shows them in the user's timezone.
+    x = mdates.date2num(timestamps.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy())
+
+    # No more points than the image can show
+    keep = lttb_rows(
+        x, [df[col].to_numpy(dtype=float) for col in columns[1:]], point_budget
+    )
+    df = df.iloc[keep]
+    x = x[keep]
 
     # Calculate total elapsed time if we have data
     if len(df) > 1:
@@ -202,7 +280,7 @@ def generate_graph_from_db(
 
     # Extract the date for title
     graph_date = (
-        df["timestamp"].dt.date.iloc[0] if not df.empty else datetime.now().date()
+        df["timestamp"].iloc[0].date() if not df.empty else datetime.now().date()
     )
 
     # Plotting
@@ -215,22 +293,31 @@ def generate_graph_from_db(
         "meat_temp1": "orange",
     }
 
+    drawstyle = "steps-post" if steps else "default"
+
     # Plot temperature lines
     for col in ["set_temp", "pit_temp", "meat_temp1"]:
         if col in df.columns and not df[col].isnull().all():
             color = colors.get(col, "gray")
             style = "--" if "set" in col.lower() else "-"
             ax.plot(
-                df["timestamp"],
+                x,
                 df[col],
                 label=f"{col.replace('_', ' ').title()} (°F)",
                 linestyle=style,
                 color=color,
+                drawstyle=drawstyle,
             )
 
         # Plot blower as duty cycle if available
     if "blower" in df.columns and not df["blower"].isnull().all():
-        ax.plot(df["timestamp"], df["blower"], label="Blower (%)", color="green")
+        ax.plot(
+            x,
+            df["blower"],
+            label="Blower (%)",
+            color="green",
+            drawstyle=drawstyle,
+        )
 
         # Titles and labels
         ax.set_title(
@@ -247,7 +334,7 @@ def generate_graph_from_db(
         ax.xaxis.set_major_formatter(local_formatter)
 
         # Set ticks every N minutes
-        locator = mdates.MinuteLocator(interval=tick_interval_minutes)
+        locator = _time_locator((x[-1] - x[0]) * 86400, tick_interval_minutes)
         ax.xaxis.set_major_locator(locator)
     except Exception as e:
         # Fallback if there's an issue with time formatting
@@ -269,3 +356,40 @@ def generate_graph_from_db(
     plt.close(fig)
 
     return buf.read()
+
+
+def generate_graph_variants(image_data, sizes, webp=True):
+    """Resize a rendered PNG for srcset
+
+    sizes maps a size name to a width in pixels; the image is never scaled
+    up. Each size is encoded as PNG and (with webp) as lossy and lossless
+    WebP, and the smallest wins, so returns {size: (mimetype, width, bytes,
+    png)}, where png is the PNG encoding when WebP won and None otherwise.
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    variants = {}
+    for size, width in sizes.items():
+        resized = image
+        if width < image.width:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+
+        encodings = [("image/png", {"format": "PNG"})]
+        if webp:
+            # Lossy suits the small, anti-aliased sizes; lossless the full one
+            encodings += [
+                ("image/webp", {"format": "WEBP", "quality": 80}),
+                ("image/webp", {"format": "WEBP", "lossless": True, "quality": 60}),
+            ]
+        candidates = []
+        for mimetype, options in encodings:
+            buf = io.BytesIO()
+            resized.save(buf, **options)
+            candidates.append((len(buf.getvalue()), mimetype, buf.getvalue()))
+        _, mimetype, data = min(candidates, key=lambda candidate: candidate[0])
+        png = candidates[0][2] if mimetype != "image/png" else None
+        variants[size] = (mimetype, resized.width, data, png)
+    return variants
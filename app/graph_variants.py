@@ -0,0 +1,87 @@
+"""
+Resized copies of uploaded graph images for srcset
+
+Uploaded graphs are rendered at 2400px wide, but the session page shows them
+at 800px at most, and smaller on a phone. Each Graph gets a thumbnail, a
+mobile and a full-width copy in the smaller of PNG and WebP, stored in the
+blob store with a GraphVariant row. When WebP wins the PNG of the same size
+is kept too, for clients that do not accept WebP. They are made once when
+the graph is uploaded, or on first request for graphs that predate them.
+"""
+from app import db
+from app.blob_store import blob_path, put_blob
+from app.models import GraphVariant
+
+# Size name -> width in pixels, smallest first, as used in srcset
+GRAPH_SIZES = {"thumb": 480, "mobile": 960, "full": 2400}
+
+
+def accepts_webp(accept_mimetypes):
+    """Whether a request's Accept header lists WebP by name (not just */*)"""
+    return any(mimetype == "image/webp" for mimetype, _ in accept_mimetypes)
+
+
+def image_mimetype(data):
+    """PNG or WebP, from the file signature"""
+    return "image/webp" if data[:4] == b"RIFF" else "image/png"
+
+
+def add_graph_variants(graph, image_data):
+    """Render every size of image_data for graph and add the rows (not committed)"""
+    from app.render_pool import render_pool
+
+    variants = render_pool.render("generate_graph_variants", image_data, GRAPH_SIZES)
+    for size, (mimetype, width, data, png) in variants.items():
+        graph.variants.append(
+            GraphVariant(
+                size=size,
+                mimetype=mimetype,
+                width=width,
+                blob_sha256=put_blob(data),
+                png_sha256=put_blob(png) if png is not None else None,
+            )
+        )
+
+
+def graph_variant(graph, size):
+    """The GraphVariant for size, making all of them first if graph has none.
+
+    Returns None if there is no variant for size, e.g. a size added to
+    GRAPH_SIZES after they were made, or if they cannot be made because the
+    original's file is missing.
+    """
+    if not graph.variants:
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            with open(blob_path(graph.blob_sha256), "rb") as image:
+                image_data = image.read()
+        except FileNotFoundError:
+            return None
+        add_graph_variants(graph, image_data)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request made them first
+            db.session.rollback()
+            db.session.refresh(graph)
+    return next((variant for variant in graph.variants if variant.size == size), None)
+
+
+def png_variant_digest(graph, variant):
+    """The blob of variant as PNG, making it first for variants that predate it"""
+    if variant.mimetype == "image/png":
+        return variant.blob_sha256
+    if variant.png_sha256 is None:
+        from app.render_pool import render_pool
+
+        with open(blob_path(graph.blob_sha256), "rb") as image:
+            resized = render_pool.render(
+                "generate_graph_variants",
+                image.read(),
+                {variant.size: GRAPH_SIZES[variant.size]},
+                webp=False,
+            )
+        variant.png_sha256 = put_blob(resized[variant.size][2])
+        db.session.commit()
+    return variant.png_sha256
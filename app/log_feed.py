@@ -0,0 +1,85 @@
+"""
+Incremental, columnar JSON feed of a session's temperature log
+
+The first request returns the whole log and a cursor; each later request
+with ?since=<cursor> returns only the rows written after it, so a polling
+client costs O(new rows) rather than a full re-render.
+
+Cursors are "<archived rows>.<last raw id>". Raw ids are monotonic, so rows
+the listener replays late with older timestamps are still picked up. If the
+archive changed since the cursor was issued (the session was archived or
+downsampled), the feed starts over with reset set.
+"""
+import numpy as np
+
+from app.lttb import lttb_columns
+from app.rollups import ROLLUP_CHANNELS
+
+
+def _parse_cursor(cursor):
+    try:
+        archived, last_id = cursor.split(".")
+        return int(archived), int(last_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _columns_to_json(columns):
+    """Columnar lists: t in epoch milliseconds, channels with null gaps"""
+    feed = {
+        "t": (columns["timestamp"].astype("datetime64[ms]").astype(np.int64)).tolist()
+    }
+    for channel in ROLLUP_CHANNELS:
+        values = columns[channel]
+        feed[channel] = np.where(np.isnan(values), None, values).tolist()
+    return feed
+
+
+def log_feed(session_id, since=None, point_budget=None):
+    """Return the feed dict for a session, starting after the since cursor.
+
+    Responses with more than point_budget readings (default
+    GRAPH_POINT_BUDGET; 0 sends everything) are reduced with LTTB.
+    """
+    from app import db
+    from app.archive import load_log_columns, new_log_columns
+    from app.models import TemperatureArchive
+    from sqlalchemy import text
+
+    archive = TemperatureArchive.query.get(session_id)
+    archived = archive.rows if archive is not None else 0
+    cursor = _parse_cursor(since)
+
+    # Fix the newest id first and read up to it, so rows landing meanwhile
+    # go out on the next poll rather than twice
+    if cursor is not None and cursor[0] == archived:
+        after_id = cursor[1]
+        last_id = (
+            db.session.execute(
+                text(
+                    "SELECT MAX(id) FROM temperature_log NOT INDEXED "
+                    "WHERE id > :after_id AND session_id = :id"
+                ),
+                {"after_id": after_id, "id": session_id},
+            ).scalar()
+            or after_id
+        )
+        columns = new_log_columns(session_id, after_id, through_id=last_id)
+        reset = False
+    else:
+        last_id = (
+            db.session.execute(
+                text("SELECT MAX(id) FROM temperature_log WHERE session_id = :id"),
+                {"id": session_id},
+            ).scalar()
+            or 0
+        )
+        columns = load_log_columns(session_id, through_id=last_id)
+        reset = True
+
+    if point_budget != 0:
+        columns = lttb_columns(columns, ROLLUP_CHANNELS, point_budget)
+    feed = _columns_to_json(columns)
+    feed["cursor"] = f"{archived}.{last_id}"
+    feed["reset"] = reset
+    return feed
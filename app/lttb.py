@@ -0,0 +1,86 @@
+"""
+Largest-Triangle-Three-Buckets downsampling to a point budget
+
+A 2400x1350 graph cannot show more than a few thousand points per series, so
+plotting and JSON responses reduce long logs to GRAPH_POINT_BUDGET points.
+LTTB keeps the points that carry the visible shape (spikes, dips, the edges
+of a stall) rather than averaging them away.
+"""
+import os
+
+import numpy as np
+
+GRAPH_POINT_BUDGET = int(os.environ.get("GRAPH_POINT_BUDGET", "2000"))
+
+
+def lttb_indices(x, y, budget):
+    """Return the indices of the points LTTB keeps from (x, y).
+
+    x must be increasing and y free of NaN. Keeps the first and last points.
+    """
+    n = len(x)
+    if budget >= n or budget < 3:
+        return np.arange(n)
+
+    # budget - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    selected = np.empty(budget, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(budget - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Twice the triangle area; the constant factor does not matter
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def lttb_rows(x, series, budget=None):
+    """Indices to keep so that every series fits the budget.
+
+    series is a list of float arrays sharing x, with NaN for missing values.
+    Each series is reduced on its own points, the results are merged, and
+    the edges of every gap are kept so lines still break where a probe had
+    no reading.
+    """
+    budget = GRAPH_POINT_BUDGET if budget is None else budget
+    n = len(x)
+    if n <= budget:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    keep = [np.array([0, n - 1])]
+    for values in series:
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        positions = np.flatnonzero(valid)
+        keep.append(positions[lttb_indices(x[positions], values[positions], budget)])
+        # First point of each gap, and the readings either side of it
+        changes = np.flatnonzero(np.diff(valid)) + 1
+        keep.append(changes)
+        keep.append(changes - 1)
+    return np.unique(np.concatenate(keep))
+
+
+def lttb_columns(columns, channels, budget=None):
+    """Apply lttb_rows to a dict of column arrays keyed by "timestamp" and channels"""
+    x = columns["timestamp"].astype("datetime64[us]").astype(np.int64) / 1e6
+    rows = lttb_rows(x, [columns[channel] for channel in channels], budget)
+    if len(rows) == len(x):
+        return columns
+    return {name: values[rows] for name, values in columns.items()}
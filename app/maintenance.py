@@ -0,0 +1,365 @@
+"""
+Periodic database maintenance: archive, downsample, analyze, reclaim space
+
+Run it by hand with `flask maintenance`, or set MAINTENANCE_INTERVAL_HOURS to
+run it from a background thread in the web app. Every step works in short
+transactions so the MQTT listener never waits on the write lock for long;
+its busy timeout and spool cover the gaps.
+"""
+import fcntl
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask.cli import with_appcontext
+
+from app.rollups import ROLLUP_CHANNELS
+
+# Readings older than this many days are thinned to LOG_DOWNSAMPLE_SECONDS;
+# 0 keeps full resolution forever
+LOG_DOWNSAMPLE_AFTER_DAYS = float(os.environ.get("LOG_DOWNSAMPLE_AFTER_DAYS", "0"))
+LOG_DOWNSAMPLE_SECONDS = int(os.environ.get("LOG_DOWNSAMPLE_SECONDS", "60"))
+# Pages freed per incremental_vacuum step, and the pause between steps
+VACUUM_STEP_PAGES = int(os.environ.get("VACUUM_STEP_PAGES", "256"))
+VACUUM_STEP_PAUSE_MS = int(os.environ.get("VACUUM_STEP_PAUSE_MS", "50"))
+# Background runs in the web app; 0 disables
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get("MAINTENANCE_INTERVAL_HOURS", "0"))
+
+# The blob store's layout, <2 hex>/<64 hex> (app/blob_store.py); only these and
+# its stale *.tmp files are removed, never anything else kept under its root
+_BLOB_DIRECTORY = re.compile(r"[0-9a-f]{2}")
+_BLOB_NAME = re.compile(r"[0-9a-f]{64}")
+
+# SQLite's auto_vacuum values
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def downsample_columns(columns, resolution):
+    """Reduce decoded log columns to one reading per resolution-second bucket.
+
+    Each bucket keeps its start time, the first cook id and the channel means.
+    """
+    import numpy as np
+    import pandas as pd
+
+    seconds = columns["timestamp"].astype("datetime64[s]").astype(np.int64)
+    frame = pd.DataFrame(
+        {name: columns[name] for name in ("cook_id",) + ROLLUP_CHANNELS}
+    )
+    grouped = frame.groupby((seconds // resolution) * resolution, sort=True)
+    thinned = grouped[list(ROLLUP_CHANNELS)].mean()
+    thinned["cook_id"] = grouped["cook_id"].first()
+    result = {
+        "timestamp": thinned.index.to_numpy(dtype=np.int64).astype("datetime64[s]").astype(
+            "datetime64[us]"
+        )
+    }
+    for name in ("cook_id",) + ROLLUP_CHANNELS:
+        result[name] = thinned[name].to_numpy(dtype=np.float64)
+    return result
+
+
+def downsample_archives(after_days, resolution):
+    """Thin archived sessions whose last reading is older than after_days"""
+    import numpy as np
+    from app import db
+    from app.archive import pack_log, unpack_log
+    from app.models import TemperatureArchive
+
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=after_days)
+    session_ids = [
+        session_id
+        for (session_id,) in db.session.query(TemperatureArchive.session_id)
+        .filter(TemperatureArchive.last_timestamp < cutoff)
+        .all()
+    ]
+    sessions = removed = 0
+    for session_id in session_ids:
+        archive = TemperatureArchive.query.get(session_id)
+        columns = unpack_log(archive.data)
+        seconds = columns["timestamp"].astype("datetime64[s]").astype(np.int64)
+        # Already one reading per bucket
+        if len(np.unique(seconds // resolution)) == len(seconds):
+            db.session.expunge(archive)
+            continue
+        thinned = downsample_columns(columns, resolution)
+        timestamps = thinned["timestamp"].tolist()
+        archive.data = pack_log(thinned)
+        removed += archive.rows - len(timestamps)
+        archive.rows = len(timestamps)
+        # Buckets are labelled by their start, so the first reading moves back
+        archive.first_timestamp = timestamps[0]
+        archive.last_timestamp = timestamps[-1]
+        db.session.commit()
+        sessions += 1
+    return sessions, removed
+
+
+def delete_orphans():
+    """Remove rollups and graph files left behind by deleted sessions"""
+    from app import db
+    from app.blob_store import blob_root
+    from app.models import Graph, GraphVariant
+    from sqlalchemy import text
+
+    rollups = db.session.execute(
+        text(
+            "DELETE FROM temperature_rollup "
+            "WHERE session_id NOT IN (SELECT id FROM bbq_session)"
+        )
+    ).rowcount
+    db.session.commit()
+
+    referenced = {
+        digest
+        for column in (Graph.blob_sha256, GraphVariant.blob_sha256, GraphVariant.png_sha256)
+        for (digest,) in db.session.query(column).distinct()
+        if digest is not None
+    }
+    # Leave recent files alone; an upload may not have committed its row yet
+    too_new = time.time() - 3600
+    files = 0
+    root = blob_root()
+    if not os.path.isdir(root):
+        return rollups, files
+    for prefix in os.listdir(root):
+        directory = os.path.join(root, prefix)
+        if not _BLOB_DIRECTORY.fullmatch(prefix) or not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                orphan = True
+            elif _BLOB_NAME.fullmatch(name) and name.startswith(prefix):
+                orphan = name not in referenced
+            else:
+                continue
+            if orphan and os.path.isfile(path) and os.path.getmtime(path) < too_new:
+                os.unlink(path)
+                files += 1
+    return rollups, files
+
+
+def analyze(connection):
+    # Bounded sampling keeps ANALYZE quick on large tables
+    connection.execute("PRAGMA analysis_limit = 1000")
+    connection.execute("ANALYZE")
+
+
+def incremental_vacuum(connection, step_pages, pause_seconds):
+    """Free pages a few at a time, releasing the write lock between steps.
+
+    Returns the number of pages given back to the filesystem.
+    """
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+        return 0
+    freed = 0
+    while True:
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free_pages:
+            break
+        # executescript steps the pragma to completion; execute() frees a
+        # single page per call
+        connection.executescript(f"PRAGMA incremental_vacuum({step_pages})")
+        step = free_pages - connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if step <= 0:
+            break
+        freed += step
+        time.sleep(pause_seconds)
+    # Best effort; a checkpoint that has to wait on readers is left for later
+    connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return freed
+
+
+def enable_incremental_vacuum(connection):
+    """Switch an existing database to auto_vacuum=INCREMENTAL.
+
+    New databases start in this mode (see SQLITE_PRAGMAS). Older ones need a
+    full VACUUM, which SQLite will not use to change auto_vacuum in WAL mode,
+    so the journal is switched to DELETE for the duration. That needs every
+    other connection closed, i.e. the listener stopped.
+    """
+    from app.sqlite_utils import SQLITE_PRAGMAS
+
+    journal_mode = connection.execute("PRAGMA journal_mode = DELETE").fetchone()[0]
+    if journal_mode.lower() != "delete":
+        raise click.ClickException(
+            "Could not leave WAL mode; stop the MQTT listener and try again"
+        )
+    try:
+        connection.execute(f"PRAGMA auto_vacuum = {_AUTO_VACUUM_INCREMENTAL}")
+        connection.execute("VACUUM")
+    finally:
+        connection.execute(f"PRAGMA journal_mode = {SQLITE_PRAGMAS['journal_mode']}")
+
+
+def run_maintenance(
+    after_days=None,
+    resolution=None,
+    step_pages=None,
+    pause_ms=None,
+    enable_incremental=False,
+):
+    """Run every maintenance step and return a report dict.
+
+    Must be called inside an app context. The report has per-step timings in
+    seconds and the bytes reclaimed from the database file.
+    """
+    from app import db
+    from app.archive import archive_completed_sessions
+
+    after_days = LOG_DOWNSAMPLE_AFTER_DAYS if after_days is None else after_days
+    resolution = LOG_DOWNSAMPLE_SECONDS if resolution is None else resolution
+    step_pages = VACUUM_STEP_PAGES if step_pages is None else step_pages
+    pause_ms = VACUUM_STEP_PAUSE_MS if pause_ms is None else pause_ms
+
+    report = {"timings": {}}
+    started = time.perf_counter()
+
+    def timed(name, func, *args):
+        step_started = time.perf_counter()
+        result = func(*args)
+        report["timings"][name] = time.perf_counter() - step_started
+        return result
+
+    report["archived_sessions"], report["archived_rows"] = timed(
+        "archive", archive_completed_sessions
+    )
+    if after_days > 0:
+        report["downsampled_sessions"], report["downsampled_rows"] = timed(
+            "downsample", downsample_archives, after_days, resolution
+        )
+    report["orphan_rollups"], report["orphan_blobs"] = timed("orphans", delete_orphans)
+    db.session.remove()
+
+    # The remaining steps manage their own transactions
+    raw = db.engine.raw_connection()
+    connection = raw.driver_connection
+    previous_isolation = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        pages_before = connection.execute("PRAGMA page_count").fetchone()[0]
+        if enable_incremental:
+            timed("enable_incremental_vacuum", enable_incremental_vacuum, connection)
+        timed("analyze", analyze, connection)
+        timed(
+            "incremental_vacuum",
+            incremental_vacuum,
+            connection,
+            step_pages,
+            pause_ms / 1000,
+        )
+        pages_after = connection.execute("PRAGMA page_count").fetchone()[0]
+        report["free_pages"] = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        report["auto_vacuum"] = connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        connection.isolation_level = previous_isolation
+        raw.close()
+
+    report["bytes_reclaimed"] = (pages_before - pages_after) * page_size
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"Archived {report['archived_sessions']} sessions ({report['archived_rows']} log rows)"
+    ]
+    if "downsampled_sessions" in report:
+        lines.append(
+            f"Downsampled {report['downsampled_sessions']} sessions "
+            f"({report['downsampled_rows']} readings removed)"
+        )
+    lines.append(
+        f"Removed {report['orphan_rollups']} orphaned rollups and "
+        f"{report['orphan_blobs']} orphaned graph files"
+    )
+    lines.append(
+        f"Reclaimed {report['bytes_reclaimed']} bytes, "
+        f"{report['free_pages']} free pages left"
+    )
+    if report["auto_vacuum"] != _AUTO_VACUUM_INCREMENTAL:
+        lines.append(
+            "auto_vacuum is not INCREMENTAL; run `flask maintenance "
+            "--enable-incremental-vacuum` once to reclaim space"
+        )
+    lines.append(
+        "Took "
+        + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report["timings"].items())
+        + f" ({report['seconds']:.2f}s total)"
+    )
+    return "\n".join(lines)
+
+
+@click.command("maintenance")
+@click.option(
+    "--downsample-after-days",
+    type=float,
+    default=None,
+    help="Thin logs older than this (default LOG_DOWNSAMPLE_AFTER_DAYS; 0 disables).",
+)
+@click.option(
+    "--resolution",
+    type=int,
+    default=None,
+    help="Seconds per reading after downsampling (default LOG_DOWNSAMPLE_SECONDS).",
+)
+@click.option(
+    "--enable-incremental-vacuum",
+    is_flag=True,
+    help="Switch auto_vacuum to INCREMENTAL with one full VACUUM (stop the listener first).",
+)
+@with_appcontext
+def maintenance_command(downsample_after_days, resolution, enable_incremental_vacuum):
+    """Archive, downsample, ANALYZE and incrementally vacuum the database."""
+    report = run_maintenance(
+        after_days=downsample_after_days,
+        resolution=resolution,
+        enable_incremental=enable_incremental_vacuum,
+    )
+    click.echo(format_report(report))
+
+
+def start_maintenance_thread(app):
+    """Run maintenance every MAINTENANCE_INTERVAL_HOURS in a daemon thread.
+
+    Each gunicorn worker starts one, so runs are serialized with a lock file
+    next to the database that also records when the last run finished;
+    workers that lose the race, or wake just after another run, skip it.
+    """
+    if MAINTENANCE_INTERVAL_HOURS <= 0:
+        return None
+
+    database_path = app.config["SQLALCHEMY_DATABASE_URI"].removeprefix("sqlite:///")
+    lock_path = database_path + ".maintenance.lock"
+
+    def loop():
+        while True:
+            time.sleep(MAINTENANCE_INTERVAL_HOURS * 3600)
+            with open(lock_path, "a+") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    lock.seek(0)
+                    last_run = float(lock.read().strip() or 0)
+                    if time.time() - last_run < MAINTENANCE_INTERVAL_HOURS * 1800:
+                        continue
+                    with app.app_context():
+                        report = run_maintenance()
+                    print(f"[{datetime.now()}] Maintenance:\n" + format_report(report))
+                    lock.truncate(0)
+                    lock.write(str(time.time()))
+                except Exception as e:
+                    print(f"Maintenance failed: {e}")
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    thread = threading.Thread(target=loop, name="maintenance", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,347 @@
+"""
+Versioned schema migrations shared by the web app and the MQTT listener
+
+db.create_all() never alters tables that already exist, so schema changes are
+listed here instead and applied in order at startup by whichever process starts
+first. The applied version is kept in SQLite's PRAGMA user_version.
+
+This module only depends on SQLAlchemy and the standard library so the listener image can ship a copy of
+it next to smokenotes_mqtt.py. Migrations are append-only: never edit one that
+has shipped, add a new one.
+"""
+
+import hashlib
+import os
+
+
+def _move_graph_blobs(connection):
+    """Move Graph.image_data into the on-disk blob store.
+
+    Uses the same layout as app/blob_store.py, which the listener image does
+    not ship. The column is NOT NULL, so moved rows keep an empty blob.
+    """
+    database_path = connection.execute("PRAGMA database_list").fetchone()[2]
+    root = os.environ.get(
+        "GRAPH_BLOB_PATH", os.path.join(os.path.dirname(database_path), "graphs")
+    )
+    graph_ids = [
+        row[0]
+        for row in connection.execute(
+            "SELECT id FROM graph WHERE blob_sha256 IS NULL AND length(image_data) > 0"
+        )
+    ]
+    # One blob in memory at a time
+    for graph_id in graph_ids:
+        (data,) = connection.execute(
+            "SELECT image_data FROM graph WHERE id = ?", (graph_id,)
+        ).fetchone()
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(root, digest[:2], digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as blob:
+                blob.write(data)
+                blob.flush()
+                os.fsync(blob.fileno())
+            os.replace(path + ".tmp", path)
+        connection.execute(
+            "UPDATE graph SET blob_sha256 = ?, image_data = x'' WHERE id = ?",
+            (digest, graph_id),
+        )
+
+
+# (version, description, steps). A step is a SQL string or a callable that
+# takes the sqlite3 connection.
+MIGRATIONS = [
+    (
+        1,
+        "Baseline tables",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS bbq_session (
+                id INTEGER NOT NULL,
+                title VARCHAR(100) NOT NULL,
+                meat_type VARCHAR(50) NOT NULL,
+                weight FLOAT,
+                smoker_type VARCHAR(50),
+                wood_type VARCHAR(50),
+                target_temp INTEGER,
+                start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                end_time DATETIME,
+                notes TEXT,
+                PRIMARY KEY (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS temperature (
+                id INTEGER NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                meat_temp FLOAT,
+                smoker_temp FLOAT,
+                note VARCHAR(200),
+                session_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS graph (
+                id INTEGER NOT NULL,
+                filename VARCHAR(100) NOT NULL,
+                image_data BLOB NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                session_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS note_entry (
+                id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                session_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS temperature_log (
+                id INTEGER NOT NULL,
+                cook_id INTEGER,
+                session_id INTEGER NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                set_temp FLOAT,
+                pit_temp FLOAT,
+                meat_temp1 FLOAT,
+                blower FLOAT,
+                PRIMARY KEY (id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_temperature_log_cook_id ON temperature_log (cook_id)",
+            "CREATE INDEX IF NOT EXISTS ix_temperature_log_timestamp ON temperature_log (timestamp)",
+            """
+            CREATE TABLE IF NOT EXISTS temperature_rollup (
+                session_id INTEGER NOT NULL,
+                resolution INTEGER NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                samples INTEGER NOT NULL,
+                set_temp_min FLOAT,
+                set_temp_max FLOAT,
+                set_temp_sum FLOAT,
+                set_temp_count INTEGER NOT NULL,
+                set_temp_last FLOAT,
+                pit_temp_min FLOAT,
+                pit_temp_max FLOAT,
+                pit_temp_sum FLOAT,
+                pit_temp_count INTEGER NOT NULL,
+                pit_temp_last FLOAT,
+                meat_temp1_min FLOAT,
+                meat_temp1_max FLOAT,
+                meat_temp1_sum FLOAT,
+                meat_temp1_count INTEGER NOT NULL,
+                meat_temp1_last FLOAT,
+                blower_min FLOAT,
+                blower_max FLOAT,
+                blower_sum FLOAT,
+                blower_count INTEGER NOT NULL,
+                blower_last FLOAT,
+                PRIMARY KEY (session_id, resolution, bucket_start),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS cook_deadline (
+                cook_id INTEGER NOT NULL,
+                end_after FLOAT NOT NULL,
+                PRIMARY KEY (cook_id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "Per-session time-series indexes",
+        [
+            # Covers the graph, export and JSON reads of a session's log
+            # without touching the table itself
+            """
+            CREATE INDEX IF NOT EXISTS ix_temperature_log_session_time
+            ON temperature_log (session_id, timestamp, set_temp, pit_temp, meat_temp1, blower)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_temperature_session_time
+            ON temperature (session_id, timestamp)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_note_entry_session_time
+            ON note_entry (session_id, timestamp)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_graph_session_created
+            ON graph (session_id, created_at)
+            """,
+        ],
+    ),
+    (
+        3,
+        "Packed archive of completed sessions",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS temperature_archive (
+                session_id INTEGER NOT NULL,
+                rows INTEGER NOT NULL,
+                first_timestamp DATETIME,
+                last_timestamp DATETIME,
+                data BLOB NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (session_id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+        ],
+    ),
+    (
+        4,
+        "Graph images in the on-disk blob store",
+        [
+            "ALTER TABLE graph ADD COLUMN blob_sha256 VARCHAR(64)",
+            "CREATE INDEX IF NOT EXISTS ix_graph_blob_sha256 ON graph (blob_sha256)",
+            _move_graph_blobs,
+        ],
+    ),
+    (
+        5,
+        "Resized graph images",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS graph_variant (
+                graph_id INTEGER NOT NULL,
+                size VARCHAR(16) NOT NULL,
+                mimetype VARCHAR(32) NOT NULL,
+                width INTEGER NOT NULL,
+                blob_sha256 VARCHAR(64) NOT NULL,
+                PRIMARY KEY (graph_id, size),
+                FOREIGN KEY(graph_id) REFERENCES graph (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_graph_variant_blob_sha256 ON graph_variant (blob_sha256)",
+        ],
+    ),
+    (
+        6,
+        "Background CSV upload jobs",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS upload_job (
+                id INTEGER NOT NULL,
+                session_id INTEGER NOT NULL,
+                filename VARCHAR(100) NOT NULL,
+                path VARCHAR(255) NOT NULL,
+                timezone VARCHAR(64) NOT NULL,
+                import_log BOOLEAN NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                graph_id INTEGER,
+                imported INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                started_at DATETIME,
+                finished_at DATETIME,
+                PRIMARY KEY (id),
+                FOREIGN KEY(session_id) REFERENCES bbq_session (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_upload_job_status ON upload_job (status, id)",
+            "CREATE INDEX IF NOT EXISTS ix_upload_job_session ON upload_job (session_id, id)",
+        ],
+    ),
+    (
+        7,
+        "Session list index",
+        [
+            # Newest-first pages of the index; rowid breaks start_time ties
+            "CREATE INDEX IF NOT EXISTS ix_bbq_session_start_time ON bbq_session (start_time)",
+        ],
+    ),
+    (
+        8,
+        "Per-session log version counter",
+        [
+            # Bumped by every writer of temperature_log; fingerprints the log
+            # for the graph cache (app/render_cache.py)
+            "ALTER TABLE bbq_session ADD COLUMN log_version INTEGER NOT NULL DEFAULT 0",
+        ],
+    ),
+    (
+        9,
+        "Cook id in the per-session log index",
+        [
+            # Raw log reads select cook_id for the archive and export; without
+            # it every row was a table lookup after the index
+            "DROP INDEX IF EXISTS ix_temperature_log_session_time",
+            """
+            CREATE INDEX IF NOT EXISTS ix_temperature_log_session_time
+            ON temperature_log (session_id, timestamp, set_temp, pit_temp, meat_temp1, blower, cook_id)
+            """,
+        ],
+    ),
+    (
+        10,
+        "PNG fallback for WebP graph variants",
+        [
+            "ALTER TABLE graph_variant ADD COLUMN png_sha256 VARCHAR(64)",
+            "CREATE INDEX IF NOT EXISTS ix_graph_variant_png_sha256 ON graph_variant (png_sha256)",
+        ],
+    ),
+    (
+        11,
+        "Time of the newest reading in each rollup",
+        ["ALTER TABLE temperature_rollup ADD COLUMN last_at FLOAT"],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(engine):
+    """Bring the database up to LATEST_VERSION.
+
+    Runs under BEGIN IMMEDIATE so the web app and the listener starting at the
+    same time cannot both apply a migration. Returns the list of versions
+    applied by this call.
+    """
+    connection = engine.raw_connection()
+    sqlite_connection = connection.driver_connection
+    # Up to date is the common case; check without taking the write lock
+    if sqlite_connection.execute("PRAGMA user_version").fetchone()[0] >= LATEST_VERSION:
+        connection.close()
+        return []
+    previous_isolation = sqlite_connection.isolation_level
+    # Manage the transaction by hand so DDL is part of it
+    sqlite_connection.isolation_level = None
+    applied = []
+    try:
+        sqlite_connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = sqlite_connection.execute("PRAGMA user_version").fetchone()[0]
+            for number, description, steps in MIGRATIONS:
+                if number <= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(sqlite_connection)
+                    else:
+                        sqlite_connection.execute(step)
+                sqlite_connection.execute(f"PRAGMA user_version = {number}")
+                applied.append(number)
+                print(f"Applied migration {number}: {description}")
+            sqlite_connection.execute("COMMIT")
+        except Exception:
+            sqlite_connection.execute("ROLLBACK")
+            raise
+    finally:
+        sqlite_connection.isolation_level = previous_isolation
+        connection.close()
+    return applied
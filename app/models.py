@@ -1,8 +1,12 @@
+from datetime import datetime, timezone
+
 from app import db
 from sqlalchemy.sql import func
 from sqlalchemy import DateTime
 
 class BBQSession(db.Model):
+    __table_args__ = (db.Index("ix_bbq_session_start_time", "start_time"),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     meat_type = db.Column(db.String(50), nullable=False)
@@ -14,6 +18,8 @@ class BBQSession(db.Model):
     start_time = db.Column(DateTime(timezone=True), server_default=func.now())
     end_time = db.Column(DateTime(timezone=True))
     notes = db.Column(db.Text)
+    # Bumped whenever rows are added to the session's temperature_log
+    log_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     
     temperatures = db.relationship(
         "Temperature", backref="session", lazy=True, cascade="all, delete-orphan"
@@ -24,19 +30,32 @@ class BBQSession(db.Model):
     graphs = db.relationship(
         "Graph", backref="session", lazy=True, cascade="all, delete-orphan"
     )
+    archive = db.relationship(
+        "TemperatureArchive", backref="session", uselist=False, cascade="all, delete-orphan"
+    )
     notes_entries = db.relationship(
         "NoteEntry", backref="session", lazy="dynamic", cascade="all, delete-orphan"
     )
+    upload_jobs = db.relationship(
+        "UploadJob", backref="session", lazy=True, cascade="all, delete-orphan"
+    )
     
-    def duration(self):
-        if self.end_time:
-            delta = self.end_time - self.start_time
-        else:
-            # Always use database time for consistency
-            from sqlalchemy import text
-            current_time = db.session.execute(text("SELECT NOW()")).scalar()
-            delta = current_time - self.start_time
-        
+    def duration(self, now=None):
+        """Cook time so far, up to end_time or now (UTC, default the current time).
+
+        Pages listing many sessions pass one now for all of them.
+        """
+        end = self.end_time
+        if end is None:
+            end = now or datetime.now(timezone.utc)
+        start = self.start_time
+        # SQLite hands DateTime columns back naive; they are stored as UTC
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        delta = end - start
+
         # Calculate total seconds
         total_seconds = int(delta.total_seconds())
         # Format as hours and minutes
@@ -53,6 +72,9 @@ class BBQSession(db.Model):
 
 
 class Temperature(db.Model):
+    # Indexes and tables are created by app/migrations.py, not create_all()
+    __table_args__ = (db.Index("ix_temperature_session_time", "session_id", "timestamp"),)
+
     id = db.Column(db.Integer, primary_key=True)
     # Use timezone-aware DateTime, stored as UTC
     timestamp = db.Column(DateTime(timezone=True), server_default=func.now())
@@ -66,18 +88,83 @@ class Temperature(db.Model):
 
 
 class Graph(db.Model):
+    __table_args__ = (db.Index("ix_graph_session_created", "session_id", "created_at"),)
+
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(100), nullable=False)
-    image_data = db.Column(db.LargeBinary, nullable=False)
+    # Legacy inline PNG, emptied once moved to the blob store; deferred so
+    # listing a session's graphs never reads it
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=False, default=b""))
+    # SHA-256 of the PNG in the blob store (app/blob_store.py)
+    blob_sha256 = db.Column(db.String(64), index=True)
     # Use timezone-aware DateTime, stored as UTC
     created_at = db.Column(DateTime(timezone=True), server_default=func.now())
     session_id = db.Column(db.Integer, db.ForeignKey("bbq_session.id"), nullable=False)
+    variants = db.relationship(
+        "GraphVariant", backref="graph", lazy=True, cascade="all, delete-orphan"
+    )
     
+    def blob_digests(self):
+        """Every blob this graph and its variants refer to"""
+        digests = [self.blob_sha256]
+        for variant in self.variants:
+            digests += [variant.blob_sha256, variant.png_sha256]
+        return digests
+
     def __repr__(self):
         return f"Graph(session_id={self.session_id})"
 
 
+class GraphVariant(db.Model):
+    """A Graph image resized for srcset (app/graph_variants.py)"""
+
+    graph_id = db.Column(db.Integer, db.ForeignKey("graph.id"), primary_key=True)
+    # Key of GRAPH_SIZES: thumb, mobile or full
+    size = db.Column(db.String(16), primary_key=True)
+    mimetype = db.Column(db.String(32), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    blob_sha256 = db.Column(db.String(64), nullable=False, index=True)
+    # Same size as PNG for clients without WebP; NULL when the variant is PNG
+    png_sha256 = db.Column(db.String(64), index=True)
+
+
+class UploadJob(db.Model):
+    """A CSV upload waiting for, or done with, the job worker (app/upload_jobs.py)"""
+
+    __tablename__ = "upload_job"
+    __table_args__ = (
+        db.Index("ix_upload_job_status", "status", "id"),
+        db.Index("ix_upload_job_session", "session_id", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("bbq_session.id"), nullable=False)
+    filename = db.Column(db.String(100), nullable=False)
+    # The spooled upload, removed once the job finishes
+    path = db.Column(db.String(255), nullable=False)
+    # The uploader's timezone, for the graph's time axis
+    timezone = db.Column(db.String(64), nullable=False)
+    import_log = db.Column(db.Boolean, nullable=False, default=False)
+    # queued, running, done or failed
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Why a failed job failed, or why a done one skipped the import; shown on
+    # the session page until dismissed
+    error = db.Column(db.Text)
+    graph_id = db.Column(db.Integer)
+    imported = db.Column(db.Integer)
+    # Use timezone-aware DateTime, stored as UTC
+    created_at = db.Column(DateTime(timezone=True), server_default=func.now())
+    started_at = db.Column(DateTime(timezone=True))
+    finished_at = db.Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<UploadJob {self.id} for Session {self.session_id} | {self.status}>"
+
+
 class NoteEntry(db.Model):
+    __table_args__ = (db.Index("ix_note_entry_session_time", "session_id", "timestamp"),)
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
     # Use timezone-aware DateTime, stored as UTC
@@ -92,6 +179,18 @@ class NoteEntry(db.Model):
 
 class TemperatureLog(db.Model):
     __tablename__ = "temperature_log"
+    __table_args__ = (
+        db.Index(
+            "ix_temperature_log_session_time",
+            "session_id",
+            "timestamp",
+            "set_temp",
+            "pit_temp",
+            "meat_temp1",
+            "blower",
+            "cook_id",
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cook_id = db.Column(db.Integer, index=True)
@@ -107,3 +206,73 @@ class TemperatureLog(db.Model):
     
     def __repr__(self):
         return f"<TempLog {self.timestamp} | Cook {self.cook_id}>"
+
+
+class TemperatureRollup(db.Model):
+    """Per-bucket aggregates of TemperatureLog at 1 and 15 minute resolution.
+
+    Means are stored as a running sum and count so buckets can be updated
+    incrementally; see app/rollups.py.
+    """
+    __tablename__ = "temperature_rollup"
+
+    session_id = db.Column(
+        db.Integer, db.ForeignKey("bbq_session.id"), primary_key=True
+    )
+    resolution = db.Column(db.Integer, primary_key=True)  # bucket width in seconds
+    # Start of the bucket, stored as UTC
+    bucket_start = db.Column(DateTime(timezone=True), primary_key=True)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    # Unix time of the newest reading folded in; NULL for older rollups
+    last_at = db.Column(db.Float)
+    set_temp_min = db.Column(db.Float)
+    set_temp_max = db.Column(db.Float)
+    set_temp_sum = db.Column(db.Float)
+    set_temp_count = db.Column(db.Integer, nullable=False, default=0)
+    set_temp_last = db.Column(db.Float)
+    pit_temp_min = db.Column(db.Float)
+    pit_temp_max = db.Column(db.Float)
+    pit_temp_sum = db.Column(db.Float)
+    pit_temp_count = db.Column(db.Integer, nullable=False, default=0)
+    pit_temp_last = db.Column(db.Float)
+    meat_temp1_min = db.Column(db.Float)
+    meat_temp1_max = db.Column(db.Float)
+    meat_temp1_sum = db.Column(db.Float)
+    meat_temp1_count = db.Column(db.Integer, nullable=False, default=0)
+    meat_temp1_last = db.Column(db.Float)
+    blower_min = db.Column(db.Float)
+    blower_max = db.Column(db.Float)
+    blower_sum = db.Column(db.Float)
+    blower_count = db.Column(db.Integer, nullable=False, default=0)
+    blower_last = db.Column(db.Float)
+
+    def mean(self, channel):
+        count = getattr(self, f"{channel}_count")
+        if not count:
+            return None
+        return getattr(self, f"{channel}_sum") / count
+
+    def __repr__(self):
+        return f"<TempRollup {self.resolution}s {self.bucket_start} | Session {self.session_id}>"
+
+
+class TemperatureArchive(db.Model):
+    """A completed session's TemperatureLog rows packed into one blob.
+
+    See app/archive.py for the format.
+    """
+    __tablename__ = "temperature_archive"
+
+    session_id = db.Column(
+        db.Integer, db.ForeignKey("bbq_session.id"), primary_key=True
+    )
+    rows = db.Column(db.Integer, nullable=False)
+    # First and last reading, stored as UTC
+    first_timestamp = db.Column(DateTime(timezone=True))
+    last_timestamp = db.Column(DateTime(timezone=True))
+    # Deferred so checking for an archive does not load the blob
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    archived_at = db.Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<TempArchive Session {self.session_id} | {self.rows} rows>"
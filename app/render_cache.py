@@ -0,0 +1,73 @@
+"""
+In-memory LRU cache of rendered graph images
+
+Keys carry everything that affects the image, including a version of the
+session's log, so a cached entry is never stale; it just stops being asked
+for. Each gunicorn worker has its own cache.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+GRAPH_CACHE_MB = float(os.environ.get("GRAPH_CACHE_MB", "32"))
+
+
+class RenderCache:
+    """Thread-safe LRU mapping of key -> bytes, bounded by total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        # Never evict everything else for an image that could not fit anyway
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+graph_cache = RenderCache(int(GRAPH_CACHE_MB * 1024 * 1024))
+
+
+def log_version(session_id):
+    """Cheap fingerprint of a session's log that changes whenever it does.
+
+    Writers bump bbq_session.log_version with every insert, including rows
+    older than the newest one (a CSV imported into a live cook); archiving
+    and downsampling change the archive row. Both are primary-key lookups,
+    so this stays fast however long the cook is.
+    """
+    from app import db
+    from sqlalchemy import text
+
+    return db.session.execute(
+        text(
+            "SELECT "
+            "(SELECT log_version FROM bbq_session WHERE id = :id), "
+            "(SELECT rows || '@' || archived_at FROM temperature_archive WHERE session_id = :id)"
+        ),
+        {"id": session_id},
+    ).one()
+
+
+def etag_for(key):
+    """Strong ETag for a cache key; equal keys always render the same bytes"""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
@@ -0,0 +1,153 @@
+"""
+Process pool that renders graphs outside the web worker
+
+Matplotlib renders are CPU-bound and can take seconds on a long cook, so
+routes hand them to a few warm worker processes (pandas and matplotlib
+already imported) and wait for the PNG. Each job gets a time limit, each
+worker an address-space limit, and at most RENDER_QUEUE_SIZE jobs wait at
+once; past that a render is refused with RenderBusy rather than queued
+behind everyone else. Each web worker process starts its own pool on first
+use. RENDER_WORKERS=0 renders inline.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_TIMEOUT_SECONDS = int(os.environ.get("RENDER_TIMEOUT_SECONDS", "60"))
+RENDER_MEMORY_MB = int(os.environ.get("RENDER_MEMORY_MB", "1024"))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", "8"))
+# Recycle workers now and then; matplotlib leaks a little per figure
+RENDER_MAX_TASKS = int(os.environ.get("RENDER_MAX_TASKS", "100"))
+
+
+class RenderError(RuntimeError):
+    """A graph could not be rendered"""
+
+
+class RenderBusy(RenderError):
+    """Too many renders are already waiting"""
+
+
+class RenderTimeout(RenderError):
+    """A render ran past RENDER_TIMEOUT_SECONDS"""
+
+
+def _on_alarm(signum, frame):
+    raise RenderTimeout()
+
+
+def _init_worker(memory_mb):
+    """Cap the worker's memory and pay the heavy imports before any job"""
+    if memory_mb > 0:
+        import resource
+
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import app.graph_utils  # noqa: F401 - pulls in pandas and pyplot
+
+
+def _run(function_name, timeout, memory_mb, args, kwargs):
+    """Worker side of a job: call a graph_utils function under an alarm"""
+    from app import graph_utils
+
+    signal.alarm(timeout)
+    try:
+        return getattr(graph_utils, function_name)(*args, **kwargs)
+    except RenderTimeout:
+        raise RenderTimeout(f"Graph rendering took longer than {timeout}s") from None
+    except MemoryError:
+        raise RenderError(f"Graph rendering used more than {memory_mb} MB") from None
+    finally:
+        signal.alarm(0)
+        # Do not let a half-drawn figure from a failed job linger
+        import matplotlib.pyplot as plt
+
+        plt.close("all")
+
+
+class RenderPool:
+    """Bounded front end to a ProcessPoolExecutor of render workers"""
+
+    def __init__(self, workers, timeout, memory_mb, queue_size, max_tasks):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.max_tasks = max_tasks
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def _get_executor(self):
+        with self.lock:
+            # A forked web worker must not reuse its parent's pool
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # Not fork: the web worker has threads and open database connections
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb,),
+                    max_tasks_per_child=self.max_tasks or None,
+                )
+                self.pid = os.getpid()
+            return self.executor
+
+    def _discard(self, executor, kill=False):
+        """Drop a broken or wedged executor so the next job starts a fresh one"""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        if kill:
+            # The alarm could not interrupt it (stuck in C code); stop it outright
+            for process in list(getattr(executor, "_processes", {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, function_name, *args, **kwargs):
+        """Run app.graph_utils.<function_name>(*args, **kwargs) and return the PNG bytes"""
+        if self.workers <= 0:
+            from app import graph_utils
+
+            return getattr(graph_utils, function_name)(*args, **kwargs)
+
+        if not self.slots.acquire(blocking=False):
+            raise RenderBusy("Too many graphs are being rendered, try again shortly")
+        try:
+            executor = self._get_executor()
+            future = executor.submit(
+                _run, function_name, self.timeout, self.memory_mb, args, kwargs
+            )
+            # Time spent queued counts too; the worker's own alarm covers the render
+            try:
+                return future.result(timeout=self.timeout * 2 + 5)
+            except FutureTimeoutError:
+                self._discard(executor, kill=True)
+                raise RenderTimeout(
+                    f"Graph rendering took longer than {self.timeout}s"
+                ) from None
+            except BrokenProcessPool:
+                # Usually a worker killed by the OOM killer
+                self._discard(executor)
+                raise RenderError("Graph rendering worker crashed") from None
+        finally:
+            self.slots.release()
+
+
+render_pool = RenderPool(
+    RENDER_WORKERS,
+    RENDER_TIMEOUT_SECONDS,
+    RENDER_MEMORY_MB,
+    RENDER_QUEUE_SIZE,
+    RENDER_MAX_TASKS,
+)
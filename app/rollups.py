@@ -0,0 +1,277 @@
+"""
+Rollups of temperature_log at coarser resolutions
+
+The MQTT listener keeps temperature_rollup up to date as it writes log rows,
+with aggregate_rollups and ROLLUP_UPSERT_SQL from this module (its image ships
+a copy, so module-level imports stay to SQLAlchemy and the standard library).
+The web app uses it to read a series at a chosen resolution and to backfill
+rollups for sessions logged before the table existed.
+"""
+from collections import namedtuple
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+
+# Query-string name: bucket width in seconds
+ROLLUP_RESOLUTIONS = {"1m": 60, "15m": 900}
+ROLLUP_CHANNELS = ("set_temp", "pit_temp", "meat_temp1", "blower")
+
+# Above this many raw rows, "auto" resolution reads rollups instead
+AUTO_RAW_ROW_LIMIT = 5000
+
+# Same attributes as TemperatureLog, so graph and export code can take either
+SeriesPoint = namedtuple("SeriesPoint", ("timestamp",) + ROLLUP_CHANNELS)
+
+_UTC = ZoneInfo("UTC")
+
+
+def _epoch(timestamp):
+    # SQLite hands back naive datetimes; everything is stored as UTC
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=_UTC)
+    return timestamp.timestamp()
+
+
+def aggregate_rollups(rows):
+    """Aggregate log rows into one parameter set per (session, resolution, bucket).
+
+    rows are dicts or objects with session_id, timestamp and the channel
+    values. Each bucket's last_at is the Unix time of its newest row, and
+    its _last values come from the newest rows that have them.
+    """
+    buckets = {}
+    for row in rows:
+        if isinstance(row, dict):
+            get = row.get
+        else:
+            get = lambda name, row=row: getattr(row, name)
+        epoch = _epoch(get("timestamp"))
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            start = int(epoch // resolution) * resolution
+            key = (get("session_id"), resolution, start)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = {
+                    "session_id": key[0],
+                    "resolution": resolution,
+                    "bucket_start": datetime.fromtimestamp(start, tz=_UTC),
+                    "samples": 0,
+                    "last_at": epoch,
+                }
+                for channel in ROLLUP_CHANNELS:
+                    bucket[f"{channel}_min"] = None
+                    bucket[f"{channel}_max"] = None
+                    bucket[f"{channel}_sum"] = None
+                    bucket[f"{channel}_count"] = 0
+                    bucket[f"{channel}_last"] = None
+                buckets[key] = bucket
+
+            bucket["samples"] += 1
+            # An older row arriving late must not replace the newer last values
+            newest = epoch >= bucket["last_at"]
+            bucket["last_at"] = max(bucket["last_at"], epoch)
+            for channel in ROLLUP_CHANNELS:
+                value = get(channel)
+                if value is None:
+                    continue
+                low = bucket[f"{channel}_min"]
+                high = bucket[f"{channel}_max"]
+                bucket[f"{channel}_min"] = value if low is None else min(low, value)
+                bucket[f"{channel}_max"] = value if high is None else max(high, value)
+                bucket[f"{channel}_sum"] = (bucket[f"{channel}_sum"] or 0) + value
+                bucket[f"{channel}_count"] += 1
+                if newest or bucket[f"{channel}_last"] is None:
+                    bucket[f"{channel}_last"] = value
+    return list(buckets.values())
+
+
+def aggregate_rollups_frame(frame, session_id):
+    """Vectorized aggregate_rollups for a DataFrame of one session's readings.
+
+    frame has a naive UTC "timestamp" column and the channel columns (NaN
+    for missing values). Returns the same parameter dicts as
+    aggregate_rollups.
+    """
+    import numpy as np
+    import pandas as pd
+
+    frame = frame.sort_values("timestamp", kind="stable")
+    epoch = frame["timestamp"].astype("datetime64[s]").astype(np.int64)
+    seconds = (frame["timestamp"] - pd.Timestamp(0)).dt.total_seconds()
+    params = []
+    for resolution in ROLLUP_RESOLUTIONS.values():
+        starts = (epoch // resolution) * resolution
+        grouped = frame[list(ROLLUP_CHANNELS)].groupby(starts)
+        buckets = pd.DataFrame({"samples": grouped.size()})
+        buckets["last_at"] = seconds.groupby(starts).max()
+        for channel in ROLLUP_CHANNELS:
+            column = grouped[channel]
+            buckets[f"{channel}_min"] = column.min()
+            buckets[f"{channel}_max"] = column.max()
+            buckets[f"{channel}_sum"] = column.sum(min_count=1)
+            buckets[f"{channel}_count"] = column.count()
+            buckets[f"{channel}_last"] = column.last()
+        buckets = buckets.astype(object).where(buckets.notna(), None)
+        for start, bucket in zip(buckets.index.tolist(), buckets.to_dict("records")):
+            bucket["session_id"] = session_id
+            bucket["resolution"] = resolution
+            bucket["bucket_start"] = datetime.fromtimestamp(start, tz=_UTC)
+            params.append(bucket)
+    return params
+
+
+def _upsert_sql():
+    columns = ["session_id", "resolution", "bucket_start", "samples", "last_at"]
+    updates = [
+        "samples = temperature_rollup.samples + excluded.samples",
+        "last_at = MAX(COALESCE(temperature_rollup.last_at, excluded.last_at), excluded.last_at)",
+    ]
+    # Batches can arrive out of order; the newer side's last values win, and
+    # rows from before last_at existed count as older
+    older = "temperature_rollup.last_at > excluded.last_at"
+    for channel in ROLLUP_CHANNELS:
+        columns += [f"{channel}_{part}" for part in ("min", "max", "sum", "count", "last")]
+        current = f"temperature_rollup.{channel}"
+        new = f"excluded.{channel}"
+        updates += [
+            f"{channel}_min = MIN(COALESCE({current}_min, {new}_min), COALESCE({new}_min, {current}_min))",
+            f"{channel}_max = MAX(COALESCE({current}_max, {new}_max), COALESCE({new}_max, {current}_max))",
+            f"{channel}_sum = COALESCE({current}_sum, 0) + COALESCE({new}_sum, 0)",
+            f"{channel}_count = {current}_count + {new}_count",
+            f"{channel}_last = CASE WHEN {older} "
+            f"THEN COALESCE({current}_last, {new}_last) "
+            f"ELSE COALESCE({new}_last, {current}_last) END",
+        ]
+    return text(
+        f"INSERT INTO temperature_rollup ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + column for column in columns)}) "
+        f"ON CONFLICT(session_id, resolution, bucket_start) DO UPDATE SET "
+        f"{', '.join(updates)}"
+    )
+
+
+ROLLUP_UPSERT_SQL = _upsert_sql()
+
+
+def apply_rollups(db_session, rows):
+    """Fold log rows into temperature_rollup inside the caller's transaction"""
+    params = aggregate_rollups(rows)
+    if params:
+        db_session.execute(ROLLUP_UPSERT_SQL, params)
+
+
+def rebuild_rollups(session_id, chunk_size=5000):
+    """Recompute all rollups for a session from its raw log rows"""
+    from app import db
+    from app.archive import session_log
+    from app.models import TemperatureRollup
+
+    TemperatureRollup.query.filter_by(session_id=session_id).delete()
+    # Archived and raw rows together
+    log = session_log(session_id)
+    for start in range(0, len(log), chunk_size):
+        apply_rollups(
+            db.session,
+            [
+                dict(point._asdict(), session_id=session_id)
+                for point in log[start:start + chunk_size]
+            ],
+        )
+    db.session.commit()
+
+
+def resolve_resolution(session_id, requested):
+    """Map a requested resolution ("raw", "1m", "15m" or "auto") to seconds.
+
+    Returns None for raw rows. "auto" reads raw rows for short cooks and
+    1-minute rollups once a session grows past AUTO_RAW_ROW_LIMIT rows.
+    """
+    from app.archive import log_row_count
+
+    if requested in ROLLUP_RESOLUTIONS:
+        return ROLLUP_RESOLUTIONS[requested]
+    if requested == "auto":
+        if log_row_count(session_id) > AUTO_RAW_ROW_LIMIT:
+            return ROLLUP_RESOLUTIONS["1m"]
+    return None
+
+
+def load_series(session_id, resolution=None):
+    """Return a session's readings, ordered by time.
+
+    Raw readings (archived or not) come back as LogPoints. With a resolution
+    in seconds each point is a SeriesPoint for a rollup bucket carrying the
+    channel means. Rollups are backfilled from the raw log the first time a
+    session without them is read.
+    """
+    from app.archive import log_row_count, session_log
+    from app.models import TemperatureRollup
+
+    if resolution is None:
+        return session_log(session_id)
+
+    def query_rollups():
+        return (
+            TemperatureRollup.query.filter_by(
+                session_id=session_id, resolution=resolution
+            )
+            .order_by(TemperatureRollup.bucket_start)
+            .all()
+        )
+
+    rollups = query_rollups()
+    if not rollups and log_row_count(session_id):
+        rebuild_rollups(session_id)
+        rollups = query_rollups()
+    return [
+        SeriesPoint(
+            rollup.bucket_start,
+            *(rollup.mean(channel) for channel in ROLLUP_CHANNELS),
+        )
+        for rollup in rollups
+    ]
+
+
+def load_series_columns(session_id, resolution=None):
+    """Like load_series, but as a dict of NumPy arrays for plotting.
+
+    timestamp is datetime64 (UTC); channels are float64 with NaN gaps.
+    """
+    import numpy as np
+    import pandas as pd
+    from app import db
+    from app.archive import load_log_columns, log_row_count
+
+    if resolution is None:
+        return load_log_columns(session_id)
+
+    def query_rollups():
+        return db.session.connection().exec_driver_sql(
+            "SELECT bucket_start, "
+            + ", ".join(f"{channel}_sum, {channel}_count" for channel in ROLLUP_CHANNELS)
+            + " FROM temperature_rollup WHERE session_id = ? AND resolution = ? "
+            "ORDER BY bucket_start",
+            (session_id, resolution),
+        ).fetchall()
+
+    rows = query_rollups()
+    if not rows and log_row_count(session_id):
+        rebuild_rollups(session_id)
+        rows = query_rollups()
+
+    frame = pd.DataFrame(
+        rows,
+        columns=["bucket_start"]
+        + [f"{channel}_{part}" for channel in ROLLUP_CHANNELS for part in ("sum", "count")],
+    )
+    columns = {
+        "timestamp": pd.to_datetime(frame["bucket_start"], format="ISO8601", utc=True)
+        .dt.tz_localize(None)
+        .to_numpy(dtype="datetime64[us]")
+    }
+    for channel in ROLLUP_CHANNELS:
+        sums = pd.to_numeric(frame[f"{channel}_sum"]).to_numpy(dtype=np.float64)
+        counts = pd.to_numeric(frame[f"{channel}_count"]).to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns[channel] = np.where(counts > 0, sums / counts, np.nan)
+    return columns
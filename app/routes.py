@@ -7,16 +7,19 @@ from flask import (
     flash,
     send_file,
     session,
+    abort,
+    make_response,
+    jsonify,
+    current_app,
 )
 from datetime import datetime
-from app.models import BBQSession, Temperature, Graph, NoteEntry
+from app.models import BBQSession, Temperature, Graph, NoteEntry, TemperatureLog, UploadJob
 from app import db
 import os
 from dotenv import load_dotenv
 import io
 from zoneinfo import ZoneInfo, available_timezones
-from werkzeug.utils import secure_filename
-from app.graph_utils import generate_graph_from_csv
+from app.render_pool import RenderBusy, render_pool
 from sqlalchemy.sql import func
 from io import StringIO
 
@@ -24,6 +27,9 @@ load_dotenv()
 
 main = Blueprint("main", __name__)
 
+# Sessions per page on the index
+INDEX_PAGE_SIZE = int(os.environ.get("INDEX_PAGE_SIZE", "24"))
+
 # Get available timezones from environment variable or use defaults
 def get_available_timezones():
     """
@@ -72,6 +78,12 @@ def page_not_found(e):
     return render_template("404.html"), 404
 
 
+@main.errorhandler(413)
+def upload_too_large(e):
+    flash(f"Uploads are limited to {current_app.config['CSV_UPLOAD_MAX_MB']:g} MB")
+    return redirect(request.referrer or url_for("main.index"))
+
+
 # Function to get the user's timezone
 def get_timezone():
     """
@@ -200,43 +212,112 @@ def upload_csv(session_id):
         flash("No selected file")
         return redirect(url_for("main.view_session", session_id=session_id))
     if file and file.filename.endswith(".csv"):
-        # Read the file
-        file_content = file.read()
+        from app.upload_jobs import enqueue_upload
+
+        # Spool the upload and let a job thread render and import it
         try:
-            # Get user's timezone using the existing function
-            user_timezone = get_timezone()
-            
-            # Generate graph image with user's timezone
-            image_data = generate_graph_from_csv(file_content, timezone=user_timezone)
-            
-            # Create Graph record
-            filename = secure_filename(file.filename)
-            graph = Graph(
-                filename=filename, image_data=image_data, session_id=session_id
+            enqueue_upload(
+                session_id,
+                file,
+                get_timezone(),
+                bool(request.form.get("import_log")),
+                int(current_app.config["CSV_UPLOAD_MAX_MB"] * 1024 * 1024),
             )
-            db.session.add(graph)
-            db.session.commit()
-            flash("CSV uploaded and graph generated successfully")
-        except Exception as e:
+            flash("CSV uploaded; the graph will appear here when it is ready")
+        except ValueError as e:
             flash(f"Error processing CSV: {str(e)}")
-            print(f"Error: {str(e)}")
     else:
         flash("Only CSV files are allowed")
     return redirect(url_for("main.view_session", session_id=session_id))
 
 
+# Polled by the session page while an upload is processed
+@main.route("/session/<int:session_id>/upload_job/<int:job_id>")
+def upload_job_status(session_id, job_id):
+    job = UploadJob.query.filter_by(id=job_id, session_id=session_id).first_or_404()
+    response = jsonify(
+        {
+            "id": job.id,
+            "filename": job.filename,
+            "status": job.status,
+            "error": job.error,
+            "graph_id": job.graph_id,
+            "imported": job.imported,
+        }
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@main.route("/session/<int:session_id>/upload_job/<int:job_id>/delete", methods=["POST"])
+def delete_upload_job(session_id, job_id):
+    from app.upload_jobs import discard_upload
+
+    job = UploadJob.query.filter_by(id=job_id, session_id=session_id).first_or_404()
+    if job.status == "running":
+        flash("That upload is being processed and cannot be removed yet")
+    else:
+        db.session.delete(job)
+        db.session.commit()
+        discard_upload(job)
+    return redirect(url_for("main.view_session", session_id=session_id))
+
+
 # Add route to view the graph
 @main.route("/graph/<int:graph_id>")
 def view_graph(graph_id):
+    from app.blob_store import blob_path
+
     graph = Graph.query.get_or_404(graph_id)
+    # The file can be gone after a partial restore even though the row is not
+    if graph.blob_sha256 is None or not os.path.exists(blob_path(graph.blob_sha256)):
+        abort(404)
     return send_file(
-        io.BytesIO(graph.image_data),
+        blob_path(graph.blob_sha256),
         mimetype="image/png",
         as_attachment=False,
         download_name=f"graph_{graph_id}.png",
     )
 
 
+@main.route("/graph/<int:graph_id>/<size>")
+def view_graph_variant(graph_id, size):
+    """The graph resized to one of GRAPH_SIZES, as PNG or WebP"""
+    from app.blob_store import blob_path
+    from app.graph_variants import (
+        GRAPH_SIZES,
+        accepts_webp,
+        graph_variant,
+        png_variant_digest,
+    )
+
+    graph = Graph.query.get_or_404(graph_id)
+    if size not in GRAPH_SIZES or graph.blob_sha256 is None:
+        abort(404)
+    variant = graph_variant(graph, size)
+    if variant is None:
+        # The original, or a 404 if its file is gone too
+        return view_graph(graph_id)
+
+    # Clients that do not list WebP get the same size as PNG
+    if variant.mimetype == "image/webp" and not accepts_webp(request.accept_mimetypes):
+        response = send_file(
+            blob_path(png_variant_digest(graph, variant)),
+            mimetype="image/png",
+            as_attachment=False,
+            download_name=f"graph_{graph_id}_{size}.png",
+        )
+    else:
+        response = send_file(
+            blob_path(variant.blob_sha256),
+            mimetype=variant.mimetype,
+            as_attachment=False,
+            download_name=f"graph_{graph_id}_{size}.{variant.mimetype.split('/')[1]}",
+        )
+    response.vary.add("Accept")
+    return response
+
+
 # Add route to edit temp
 @main.route("/session/<int:session_id>/temp/<int:temp_id>/edit", methods=["POST"])
 def edit_temperature(session_id, temp_id):
@@ -300,17 +381,61 @@ def edit_note(session_id, note_id):
 # Add route to delete a graph
 @main.route("/session/<int:session_id>/graph/<int:graph_id>/delete", methods=["POST"])
 def delete_graph(session_id, graph_id):
+    from app.blob_store import prune_blobs
+
     graph = Graph.query.get_or_404(graph_id)
+    digests = graph.blob_digests()
     db.session.delete(graph)
     db.session.commit()
+    prune_blobs(digests)
     flash("Graph deleted successfully")
     return redirect(url_for("main.view_session", session_id=session_id))
 
 
 @main.route("/")
 def index():
-    sessions = BBQSession.query.order_by(BBQSession.start_time.desc()).all()
-    return render_template("index.html", sessions=sessions)
+    from sqlalchemy import String, tuple_, type_coerce
+    from sqlalchemy.orm import load_only
+
+    # Compare the stored text, not a re-rendered datetime: rows written by
+    # the listener and by CURRENT_TIMESTAMP differ in format, and ORDER BY
+    # sorts the text
+    start_key = type_coerce(BBQSession.start_time, String)
+    query = BBQSession.query.options(
+        load_only(
+            BBQSession.id,
+            BBQSession.title,
+            BBQSession.meat_type,
+            BBQSession.start_time,
+            BBQSession.end_time,
+        )
+    )
+
+    # Keyset pagination: ?before=<id of the last session on the previous page>
+    before = request.args.get("before", type=int)
+    if before is not None:
+        cursor = (
+            db.session.query(start_key, BBQSession.id)
+            .filter(BBQSession.id == before)
+            .first()
+        )
+        if cursor is not None:
+            query = query.filter(tuple_(start_key, BBQSession.id) < tuple(cursor))
+
+    sessions = (
+        query.order_by(BBQSession.start_time.desc(), BBQSession.id.desc())
+        .limit(INDEX_PAGE_SIZE + 1)
+        .all()
+    )
+    older = sessions[INDEX_PAGE_SIZE - 1].id if len(sessions) > INDEX_PAGE_SIZE else None
+    return render_template(
+        "index.html",
+        sessions=sessions[:INDEX_PAGE_SIZE],
+        older=older,
+        first_page=before is None,
+        # One clock for every open session's duration on the page
+        now=datetime.now(timezone.utc),
+    )
 
 
 @main.route("/session/new", methods=["GET", "POST"])
@@ -349,8 +474,33 @@ from datetime import timezone
 
 @main.route("/session/<int:session_id>")
 def view_session(session_id):
+    from app.graph_variants import GRAPH_SIZES
+
     session = BBQSession.query.get_or_404(session_id)
-    return render_template("session.html", session=session, timezone=timezone)
+    # Only need to know whether any log rows exist, not load them all
+    has_log_entries = (
+        session.archive is not None
+        or TemperatureLog.query.filter_by(session_id=session_id).first() is not None
+    )
+    # Finished jobs show up as their graph; the rest, and finished ones with
+    # a notice, are listed with a status
+    upload_jobs = (
+        UploadJob.query.filter(
+            UploadJob.session_id == session_id,
+            (UploadJob.status != "done") | UploadJob.error.isnot(None),
+        )
+        .order_by(UploadJob.id)
+        .all()
+    )
+
+    return render_template(
+        "session.html",
+        session=session,
+        timezone=timezone,
+        has_log_entries=has_log_entries,
+        graph_sizes=GRAPH_SIZES,
+        upload_jobs=upload_jobs,
+    )
 
 
 @main.route("/session/<int:session_id>/edit", methods=["GET", "POST"])
@@ -382,7 +532,12 @@ def edit_session(session_id):
             from sqlalchemy import func  # type: ignore
 
             session.end_time = func.now()
+            db.session.commit()
+
+            # The log is final now, pack it into a single archive row
+            from app.archive import archive_session
 
+            archive_session(session.id)
 
         db.session.commit()
         return redirect(url_for("main.view_session", session_id=session.id))
@@ -429,11 +584,19 @@ def add_temperature(session_id):
 
 @main.route("/session/<int:session_id>/delete", methods=["POST"])
 def delete_session(session_id):
+    from app.blob_store import prune_blobs
+    from app.upload_jobs import discard_upload
+
     session = BBQSession.query.get_or_404(session_id)
     # First delete all related temperature logs
     # TemperatureLog.query.filter_by(session_id=session_id).delete()
+    digests = [digest for graph in session.graphs for digest in graph.blob_digests()]
+    jobs = list(session.upload_jobs)
     db.session.delete(session)
     db.session.commit()
+    prune_blobs(digests)
+    for job in jobs:
+        discard_upload(job)
     return redirect(url_for("main.index"))
 
 
@@ -487,6 +650,11 @@ def complete_session(session_id):
     # Save to database
     db.session.commit()
 
+    # The log is final now, pack it into a single archive row
+    from app.archive import archive_session
+
+    archive_session(session_id)
+
     # Flash a success message
     flash("BBQ session completed successfully!", "success")
 
@@ -499,36 +667,108 @@ def view_temp_log_graph(session_id):
     # Get the BBQ session
     session = BBQSession.query.get_or_404(session_id)
 
-    # Get all temperature logs for this session
-    from app.models import TemperatureLog
+    # Raw rows for short cooks, rollups for long ones unless ?resolution= says otherwise
+    from app.rollups import load_series_columns, resolve_resolution
+    from app.render_cache import etag_for, graph_cache, log_version
+    from app.graph_variants import GRAPH_SIZES, accepts_webp, image_mimetype
 
-    temp_logs = (
-        TemperatureLog.query.filter_by(session_id=session_id)
-        .order_by(TemperatureLog.timestamp)
-        .all()
-    )
+    requested = request.args.get("resolution", "auto")
+    # ?size= picks one of GRAPH_SIZES; smaller ones may be WebP
+    size = request.args.get("size", "full")
+    if size not in GRAPH_SIZES:
+        abort(404)
+    webp = size != "full" and accepts_webp(request.accept_mimetypes)
+    tick_interval_minutes = 15
 
     # Use the existing timezone function
     user_timezone = get_timezone()
 
-    # Generate graph
-    from app.graph_utils import generate_graph_from_db
+    # Unchanged log, same settings: answer from the browser's or our cache
+    full_key = (
+        "temp_log_graph",
+        session_id,
+        tuple(log_version(session_id)),
+        requested,
+        user_timezone,
+        tick_interval_minutes,
+    )
+    cache_key = full_key if size == "full" else full_key + (size, webp)
+    etag = etag_for(cache_key)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept")
+        return response
 
+    # Generate graph
     try:
-        image_data = generate_graph_from_db(temp_logs, timezone=user_timezone)
-
-        # Return the image
-        return send_file(
+        image_data = graph_cache.get(cache_key)
+        if image_data is None:
+            image_data = graph_cache.get(full_key)
+            if image_data is None:
+                resolution = resolve_resolution(session_id, requested)
+                temp_logs = load_series_columns(session_id, resolution)
+                # Raw rows may be deadband-filtered, so hold each value until the next row
+                image_data = render_pool.render(
+                    "generate_graph_from_db",
+                    temp_logs,
+                    timezone=user_timezone,
+                    tick_interval_minutes=tick_interval_minutes,
+                    steps=resolution is None,
+                )
+                graph_cache.put(full_key, image_data)
+            if size != "full":
+                variants = render_pool.render(
+                    "generate_graph_variants",
+                    image_data,
+                    {size: GRAPH_SIZES[size]},
+                    webp=webp,
+                )
+                image_data = variants[size][2]
+                graph_cache.put(cache_key, image_data)
+
+        # Return the image; no-cache makes browsers revalidate with the ETag
+        mimetype = image_mimetype(image_data)
+        response = send_file(
             io.BytesIO(image_data),
-            mimetype="image/png",
+            mimetype=mimetype,
             as_attachment=False,
-            download_name=f"temp_log_graph_{session_id}.png",
+            download_name=f"temp_log_graph_{session_id}.{mimetype.split('/')[1]}",
+            etag=etag,
         )
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept")
+        return response
+    except RenderBusy as e:
+        response = make_response(str(e), 503)
+        response.headers["Retry-After"] = "5"
+        return response
     except Exception as e:
         flash(f"Error generating graph: {str(e)}", "error")
         return redirect(url_for("main.view_session", session_id=session_id))
 
 
+@main.route("/session/<int:session_id>/temp_log.json")
+def temp_log_json(session_id):
+    """Columnar log readings newer than ?since=<cursor> (all of them without it).
+
+    ?points=N caps the readings returned (0 for all of them).
+    """
+    from app.log_feed import log_feed
+
+    BBQSession.query.get_or_404(session_id)
+    response = jsonify(
+        log_feed(
+            session_id,
+            request.args.get("since"),
+            request.args.get("points", type=int),
+        )
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
 @main.route("/session/<int:session_id>/add_weather", methods=["POST"])
 def add_weather(session_id):
     """Add weather information as a note to the BBQ session"""
@@ -586,7 +826,11 @@ def export_session_csv(session_id):
         # Get all related data
         temperatures = Temperature.query.filter_by(session_id=session_id).order_by(Temperature.timestamp).all()
         notes = NoteEntry.query.filter_by(session_id=session_id).order_by(NoteEntry.timestamp).all()
-        temp_logs = TemperatureLog.query.filter_by(session_id=session_id).order_by(TemperatureLog.timestamp).all()
+        # Full-resolution rows unless ?resolution=1m or 15m asks for rollup means
+        from app.rollups import load_series, resolve_resolution
+
+        resolution = resolve_resolution(session_id, request.args.get("resolution", "raw"))
+        temp_logs = load_series(session_id, resolution)
         
         output = StringIO()
         
@@ -634,7 +878,7 @@ def export_session_csv(session_id):
                 pit_temp_formatted = format_temp(log.pit_temp)
                 meat_temp1_formatted = format_temp(log.meat_temp1)
                 blower_formatted = format_blower(log.blower)
-                output.write(f"{log.timestamp},{log.cook_id or ''},{set_temp_formatted},{pit_temp_formatted},{meat_temp1_formatted},{blower_formatted}\n")
+                output.write(f"{log.timestamp},{getattr(log, 'cook_id', None) or ''},{set_temp_formatted},{pit_temp_formatted},{meat_temp1_formatted},{blower_formatted}\n")
             output.write("\n")
         
         # Notes
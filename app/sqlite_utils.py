@@ -0,0 +1,36 @@
+"""
+SQLite connection settings shared by the web app and the MQTT listener
+
+The listener image ships a copy of this module, so it only imports SQLAlchemy.
+"""
+import os
+from sqlalchemy import event
+
+# Both processes open the same database file, so they must agree on these.
+# Set SQLITE_JOURNAL_MODE=DELETE to fall back to SQLite's rollback journal.
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # Only takes effect on a new database, and only before WAL is enabled
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    # Negative values are KiB rather than pages
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", "-16000")),
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to a freshly opened pooled connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def configure_sqlite_engine(engine):
+    """Register the pragma hook on an engine if it talks to SQLite"""
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", apply_sqlite_pragmas)
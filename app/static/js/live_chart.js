@@ -0,0 +1,173 @@
+// Live temperature chart drawn on a canvas from /session/<id>/temp_log.json.
+// Polls with the feed's cursor so each refresh only downloads new readings.
+
+const LIVE_CHART_SERIES = [
+    { key: 'set_temp', label: 'Set Temp (°F)', color: 'blue', dash: [6, 4] },
+    { key: 'pit_temp', label: 'Pit Temp (°F)', color: 'red', dash: [] },
+    { key: 'meat_temp1', label: 'Meat Temp1 (°F)', color: 'orange', dash: [] },
+    { key: 'blower', label: 'Blower (%)', color: 'green', dash: [] },
+];
+
+class LiveChart {
+    // timeZone is the app's selected IANA zone, so the axis matches the PNG graphs
+    constructor(canvas, feedUrl, intervalMs, timeZone) {
+        this.canvas = canvas;
+        this.feedUrl = feedUrl;
+        this.intervalMs = intervalMs;
+        this.timeZone = timeZone;
+        this.cursor = null;
+        this.data = { t: [] };
+        LIVE_CHART_SERIES.forEach(series => { this.data[series.key] = []; });
+        window.addEventListener('resize', () => this.draw());
+    }
+
+    start() {
+        this.refresh();
+        this.timer = setInterval(() => this.refresh(), this.intervalMs);
+    }
+
+    refresh() {
+        const url = this.cursor === null
+            ? this.feedUrl
+            : `${this.feedUrl}?since=${encodeURIComponent(this.cursor)}`;
+        return fetch(url)
+            .then(response => response.json())
+            .then(feed => {
+                this.append(feed);
+                this.cursor = feed.cursor;
+                this.draw();
+            })
+            .catch(error => console.error('Error refreshing live chart:', error));
+    }
+
+    append(feed) {
+        if (feed.reset) {
+            this.data = { t: [] };
+            LIVE_CHART_SERIES.forEach(series => { this.data[series.key] = []; });
+        }
+        if (!feed.t.length) {
+            return;
+        }
+        const lastTime = this.data.t.length ? this.data.t[this.data.t.length - 1] : -Infinity;
+        this.data.t.push(...feed.t);
+        LIVE_CHART_SERIES.forEach(series => this.data[series.key].push(...feed[series.key]));
+
+        // Late readings (e.g. replayed by the listener) can arrive out of order
+        if (feed.t[0] < lastTime) {
+            const order = this.data.t.map((_, i) => i).sort((a, b) => this.data.t[a] - this.data.t[b]);
+            Object.keys(this.data).forEach(key => {
+                const values = this.data[key];
+                this.data[key] = order.map(i => values[i]);
+            });
+        }
+    }
+
+    draw() {
+        const canvas = this.canvas;
+        const ratio = window.devicePixelRatio || 1;
+        const width = canvas.clientWidth;
+        const height = Math.round(width * 9 / 16);
+        canvas.width = width * ratio;
+        canvas.height = height * ratio;
+        canvas.style.height = `${height}px`;
+
+        const ctx = canvas.getContext('2d');
+        ctx.scale(ratio, ratio);
+        ctx.clearRect(0, 0, width, height);
+
+        const style = getComputedStyle(canvas);
+        ctx.fillStyle = style.color;
+        ctx.strokeStyle = style.color;
+        ctx.font = '12px sans-serif';
+
+        const times = this.data.t;
+        if (!times.length) {
+            ctx.textAlign = 'center';
+            ctx.fillText('No temperature data available', width / 2, height / 2);
+            return;
+        }
+
+        let low = Infinity;
+        let high = -Infinity;
+        LIVE_CHART_SERIES.forEach(series => {
+            this.data[series.key].forEach(value => {
+                if (value !== null) {
+                    low = Math.min(low, value);
+                    high = Math.max(high, value);
+                }
+            });
+        });
+        // 25°F grid like the server-rendered graph
+        low = Math.floor(Math.min(low, 0) / 25) * 25;
+        high = Math.max(Math.ceil(high / 25) * 25, low + 25);
+
+        const plot = { left: 45, right: width - 10, top: 10, bottom: height - 45 };
+        const start = times[0];
+        const span = Math.max(times[times.length - 1] - start, 1);
+        const x = t => plot.left + (t - start) / span * (plot.right - plot.left);
+        const y = v => plot.bottom - (v - low) / (high - low) * (plot.bottom - plot.top);
+
+        // Grid and axis labels
+        ctx.globalAlpha = 0.3;
+        ctx.setLineDash([2, 3]);
+        ctx.textAlign = 'right';
+        for (let value = low; value <= high; value += 25) {
+            ctx.beginPath();
+            ctx.moveTo(plot.left, y(value));
+            ctx.lineTo(plot.right, y(value));
+            ctx.stroke();
+        }
+        ctx.globalAlpha = 1;
+        ctx.setLineDash([]);
+        for (let value = low; value <= high; value += 25) {
+            ctx.fillText(value, plot.left - 5, y(value) + 4);
+        }
+        ctx.textAlign = 'center';
+        const ticks = Math.max(2, Math.floor((plot.right - plot.left) / 90));
+        for (let i = 0; i <= ticks; i++) {
+            const t = start + span * i / ticks;
+            const label = new Date(t).toLocaleTimeString([], {
+                hour: '2-digit', minute: '2-digit', timeZone: this.timeZone,
+            });
+            ctx.fillText(label, x(t), plot.bottom + 16);
+        }
+
+        // Series, with gaps where a probe had no reading. With a deadband
+        // the listener skips readings that barely changed, so each value holds
+        // until the next row: drawn as steps, like the rendered graph.
+        ctx.lineWidth = 1.5;
+        LIVE_CHART_SERIES.forEach(series => {
+            const values = this.data[series.key];
+            ctx.strokeStyle = series.color;
+            ctx.setLineDash(series.dash);
+            ctx.beginPath();
+            let drawing = false;
+            for (let i = 0; i < times.length; i++) {
+                if (values[i] === null) {
+                    drawing = false;
+                    continue;
+                }
+                if (drawing) {
+                    ctx.lineTo(x(times[i]), y(values[i - 1]));
+                    ctx.lineTo(x(times[i]), y(values[i]));
+                } else {
+                    ctx.moveTo(x(times[i]), y(values[i]));
+                    drawing = true;
+                }
+            }
+            ctx.stroke();
+        });
+        ctx.setLineDash([]);
+
+        // Legend along the bottom
+        ctx.textAlign = 'left';
+        let legendX = plot.left;
+        LIVE_CHART_SERIES.forEach(series => {
+            ctx.fillStyle = series.color;
+            ctx.fillRect(legendX, height - 16, 12, 3);
+            ctx.fillStyle = style.color;
+            ctx.fillText(series.label, legendX + 16, height - 11);
+            legendX += ctx.measureText(series.label).width + 32;
+        });
+    }
+}
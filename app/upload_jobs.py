@@ -0,0 +1,221 @@
+"""
+Background processing of CSV uploads
+
+upload_csv only spools the file next to the database and adds a queued
+UploadJob row, so the request returns at once however long the render and
+import take. Each web worker runs a job thread that claims queued rows and
+does the work; the claim is a conditional UPDATE, so with several gunicorn
+workers polling the same table each job still runs once. The session page
+polls the job's status and reloads when it finishes. Failed jobs keep their
+error, and finished ones that skipped the import a notice, until dismissed.
+
+A job left running by a worker that died (restart, OOM kill) is claimed
+again once it has been running for UPLOAD_JOB_STALE_SECONDS, up to
+_MAX_ATTEMPTS times.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import db
+from app.models import Graph, UploadJob
+
+# How often an idle job thread checks for work queued by other workers
+UPLOAD_JOB_POLL_SECONDS = float(os.environ.get("UPLOAD_JOB_POLL_SECONDS", "2"))
+# A running job older than this is assumed lost with its worker
+UPLOAD_JOB_STALE_SECONDS = int(os.environ.get("UPLOAD_JOB_STALE_SECONDS", "900"))
+
+_MAX_ATTEMPTS = 3
+# Finished jobs are only kept long enough for the page polling them
+_KEEP_FINISHED = timedelta(days=1)
+
+# Set by enqueue_upload so this worker's thread starts without waiting a poll
+_wake = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def upload_spool_root():
+    database_path = os.environ.get("DATABASE_PATH", "/app/data/bbq_sessions.db")
+    return os.environ.get(
+        "UPLOAD_SPOOL_PATH", os.path.join(os.path.dirname(database_path), "uploads")
+    )
+
+
+def enqueue_upload(session_id, file, user_timezone, import_log, max_bytes):
+    """Spool an uploaded CSV and queue it; returns the committed UploadJob.
+
+    Raises ValueError if the file is larger than max_bytes.
+    """
+    from werkzeug.utils import secure_filename
+
+    from app.csv_import import save_upload
+
+    root = upload_spool_root()
+    os.makedirs(root, exist_ok=True)
+    path = save_upload(file.stream, max_bytes, directory=root)
+    job = UploadJob(
+        session_id=session_id,
+        filename=secure_filename(file.filename),
+        path=path,
+        timezone=user_timezone,
+        import_log=import_log,
+        status="queued",
+        attempts=0,
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.unlink(path)
+        raise
+    _wake.set()
+    return job
+
+
+def discard_upload(job):
+    """Remove a job's spooled file, if it is still there"""
+    try:
+        os.unlink(job.path)
+    except FileNotFoundError:
+        pass
+
+
+def _finish(job, status, error=None):
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+    discard_upload(job)
+
+
+def _claim_next_job():
+    """Mark the oldest runnable job as running for this thread and return it"""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)
+    runnable = (UploadJob.status == "queued") | (
+        (UploadJob.status == "running") & (UploadJob.started_at < stale)
+    )
+    while True:
+        job = UploadJob.query.filter(runnable).order_by(UploadJob.id).first()
+        if job is None:
+            return None
+        if job.attempts >= _MAX_ATTEMPTS:
+            _finish(job, "failed", f"Processing was interrupted {job.attempts} times")
+            continue
+        # Every claim bumps attempts, so only one worker's UPDATE matches
+        claimed = UploadJob.query.filter(
+            UploadJob.id == job.id, UploadJob.attempts == job.attempts, runnable
+        ).update(
+            {"status": "running", "attempts": job.attempts + 1, "started_at": now},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+
+def _render_graph(job):
+    """Render the job's CSV, waiting for room in the render pool"""
+    from app.render_pool import RenderBusy, render_pool
+
+    while True:
+        try:
+            return render_pool.render(
+                "generate_graph_from_csv", job.path, timezone=job.timezone
+            )
+        except RenderBusy:
+            time.sleep(UPLOAD_JOB_POLL_SECONDS)
+
+
+def run_job(job):
+    """Make the graph for a claimed job and import its readings"""
+    from app.blob_store import put_blob
+    from app.graph_variants import add_graph_variants
+
+    try:
+        # A retried job keeps the graph an earlier attempt committed
+        if job.graph_id is None:
+            image_data = _render_graph(job)
+            graph = Graph(
+                filename=job.filename,
+                blob_sha256=put_blob(image_data),
+                session_id=job.session_id,
+            )
+            db.session.add(graph)
+
+            # Smaller copies for srcset; if this fails they are made on first view
+            try:
+                add_graph_variants(graph, image_data)
+            except Exception as e:
+                print(f"Error resizing graph: {str(e)}")
+            db.session.flush()
+            job.graph_id = graph.id
+            db.session.commit()
+
+        # Re-importing skips rows already there, so retries are safe
+        notice = None
+        if job.import_log:
+            from app.csv_import import import_csv_log, is_flameboss_csv
+
+            # Other CSVs can be graphed but have no columns to import
+            if is_flameboss_csv(job.path):
+                job.imported = import_csv_log(job.session_id, job.path)
+            else:
+                notice = "Not a FlameBoss export, so its readings were not imported"
+        _finish(job, "done", notice)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Upload job {job.id} failed: {str(e)}")
+        _finish(job, "failed", f"Error processing CSV: {str(e)}")
+
+
+def run_pending_jobs():
+    """Run queued jobs until there are none; returns how many ran.
+
+    Must be called inside an app context.
+    """
+    ran = 0
+    while (job := _claim_next_job()) is not None:
+        run_job(job)
+        ran += 1
+    UploadJob.query.filter(
+        UploadJob.status == "done",
+        UploadJob.finished_at < datetime.now(timezone.utc) - _KEEP_FINISHED,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return ran
+
+
+def ensure_upload_worker(app):
+    """Start this web worker's job thread unless it is already running.
+
+    Called on each request rather than from create_app, so CLI commands
+    never claim a job and exit half way through it.
+    """
+    global _worker
+    if _worker is not None:
+        return _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = _start_upload_worker(app)
+    return _worker
+
+
+def _start_upload_worker(app):
+    def loop():
+        while True:
+            _wake.wait(UPLOAD_JOB_POLL_SECONDS)
+            _wake.clear()
+            try:
+                with app.app_context():
+                    run_pending_jobs()
+            except Exception as e:
+                print(f"Upload job worker failed: {e}")
+
+    thread = threading.Thread(target=loop, name="upload-jobs", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,222 @@
+"""
+Time and peak memory of rendering a session's temperature log graph
+
+Seeds one session per size into a scratch database (synthetic readings two
+seconds apart, like a FlameBoss) and renders each with generate_graph_from_db.
+The scratch database is created with the original schema and plain inserts,
+then opened with create_app() so the checkout upgrades it the way it would a
+real one; nothing else from the app is assumed, so the same script runs on
+any checkout. Each session is loaded as TemperatureLog rows and, where the
+checkout has app.rollups.load_series_columns, also as the column arrays the
+graph route reads. Every render runs in its own process so the peak RSS
+belongs to that render alone. Run it in two checkouts to compare before and
+after:
+
+    python graph_benchmark.py
+    # Draw every sample, as before LTTB downsampling
+    python graph_benchmark.py --sizes 10000 100000 --point-budget 1000000
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+# The two tables as the first release created them
+_SCHEMA = [
+    """
+    CREATE TABLE bbq_session (
+        id INTEGER NOT NULL PRIMARY KEY,
+        title VARCHAR(100) NOT NULL,
+        meat_type VARCHAR(50) NOT NULL,
+        weight FLOAT,
+        smoker_type VARCHAR(50),
+        wood_type VARCHAR(50),
+        target_temp INTEGER,
+        start_time DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        end_time DATETIME,
+        notes TEXT
+    )
+    """,
+    """
+    CREATE TABLE temperature_log (
+        id INTEGER NOT NULL PRIMARY KEY,
+        cook_id INTEGER,
+        session_id INTEGER NOT NULL REFERENCES bbq_session (id),
+        timestamp DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL,
+        set_temp FLOAT,
+        pit_temp FLOAT,
+        meat_temp1 FLOAT,
+        blower FLOAT
+    )
+    """,
+    "CREATE INDEX ix_temperature_log_cook_id ON temperature_log (cook_id)",
+    "CREATE INDEX ix_temperature_log_timestamp ON temperature_log (timestamp)",
+]
+
+
+def seed(database_path, sizes):
+    """Create the schema and one completed session per size; returns their ids"""
+    connection = sqlite3.connect(database_path)
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    random.seed(1)
+    session_ids = []
+    for rows in sizes:
+        start = datetime(2025, 1, 1)
+        cursor = connection.execute(
+            "INSERT INTO bbq_session (title, meat_type, start_time, end_time) VALUES (?, ?, ?, ?)",
+            (
+                f"Benchmark {rows} rows",
+                "brisket",
+                start.strftime(_TIMESTAMP_FORMAT),
+                (start + timedelta(seconds=2 * rows)).strftime(_TIMESTAMP_FORMAT),
+            ),
+        )
+        session_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO temperature_log "
+            "(cook_id, session_id, timestamp, set_temp, pit_temp, meat_temp1, blower) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    session_id,
+                    session_id,
+                    (start + timedelta(seconds=2 * i)).strftime(_TIMESTAMP_FORMAT),
+                    225.0,
+                    225.0 + random.uniform(-10, 10),
+                    40.0 + 160.0 * i / rows,
+                    random.uniform(0, 100),
+                )
+                for i in range(rows)
+            ),
+        )
+        connection.commit()
+        session_ids.append(session_id)
+    connection.close()
+
+    # Let the checkout bring the schema up to date, as it would on startup
+    from app import create_app
+
+    create_app()
+    return session_ids
+
+
+def has_column_loader():
+    try:
+        from app.rollups import load_series_columns  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def render(session_id, load, timezone, point_budget):
+    """Child process: render one session and print its timings as JSON"""
+    os.environ["SCHEMA_MIGRATED"] = "1"
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from app import create_app
+    from app.graph_utils import generate_graph_from_db
+    from app.models import TemperatureLog
+
+    # Older checkouts have neither step drawing nor a point budget
+    accepted = inspect.signature(generate_graph_from_db).parameters
+    options = {"timezone": timezone}
+    if "steps" in accepted:
+        options["steps"] = True
+    if "point_budget" in accepted and point_budget is not None:
+        options["point_budget"] = point_budget
+
+    app = create_app()
+    with app.app_context():
+        if load == "columns":
+            from app.rollups import load_series_columns
+        # Everything imported, so the growth below is the render itself
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        if load == "columns":
+            temp_logs = load_series_columns(session_id)
+        else:
+            temp_logs = (
+                TemperatureLog.query.filter_by(session_id=session_id)
+                .order_by(TemperatureLog.timestamp)
+                .all()
+            )
+        loaded = time.perf_counter()
+        image = generate_graph_from_db(temp_logs, **options)
+        finished = time.perf_counter()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "load": loaded - started,
+                "render": finished - loaded,
+                "peak_mib": (peak - baseline) / 1024,
+                "png_bytes": len(image),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Rows per session"
+    )
+    parser.add_argument("--timezone", default="America/Chicago")
+    parser.add_argument(
+        "--point-budget", type=int, help="Most points per series drawn (default GRAPH_POINT_BUDGET)"
+    )
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--load", default="rows", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        render(args.child, args.load, args.timezone, args.point_budget)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database_path = os.path.join(scratch, "benchmark.db")
+        os.environ["DATABASE_PATH"] = database_path
+        print(f"Seeding {', '.join(str(rows) for rows in args.sizes)} rows...")
+        session_ids = seed(database_path, args.sizes)
+
+        loads = ["rows", "columns"] if has_column_loader() else ["rows"]
+        print(
+            f"{'rows':>9}  {'loaded as':>9}  {'load':>8}  {'render':>8}  {'total':>8}  {'peak RSS':>10}"
+        )
+        for rows, session_id in zip(args.sizes, session_ids):
+            for load in loads:
+                command = [
+                    sys.executable, __file__, "--child", str(session_id),
+                    "--load", load, "--timezone", args.timezone,
+                ]
+                if args.point_budget is not None:
+                    command += ["--point-budget", str(args.point_budget)]
+                result = subprocess.run(
+                    command, cwd=REPO_ROOT, env=os.environ, capture_output=True, text=True
+                )
+                if result.returncode != 0:
+                    sys.exit(result.stderr)
+                timings = json.loads(result.stdout.splitlines()[-1])
+                print(
+                    f"{rows:>9}  {load:>9}  {timings['load']:>7.2f}s  {timings['render']:>7.2f}s  "
+                    f"{timings['load'] + timings['render']:>7.2f}s  {timings['peak_mib']:>6.0f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_ROOT)
+    main()
@@ -0,0 +1,26 @@
+"""
+gunicorn settings for the web app
+
+The schema is migrated once here in the master before any worker starts, so
+worker boots (and restarts after recycling) skip it.
+"""
+import os
+
+bind = "0.0.0.0:5000"
+# Threads keep pages responsive while a request waits on the render pool
+worker_class = "gthread"
+threads = 4
+
+
+def on_starting(server):
+    from sqlalchemy import create_engine
+
+    from app import database_uri, migrate_database
+    from app.sqlite_utils import configure_sqlite_engine
+
+    engine = create_engine(database_uri())
+    configure_sqlite_engine(engine)
+    migrate_database(engine)
+    engine.dispose()
+    # Inherited by every worker forked from the master
+    os.environ["SCHEMA_MIGRATED"] = "1"
@@ -0,0 +1,127 @@
+"""
+Check that per-session reads use the indexes from app/migrations.py
+
+Runs EXPLAIN QUERY PLAN for the app's hot per-session queries against a
+freshly migrated database (or a copy of a real one, whose ANALYZE statistics
+can change the planner's choices) and prints each plan. Exits non-zero if a
+query stops using its index or needs a temporary B-tree to sort, so a schema
+or query change that loses an index fails in CI:
+
+    python query_plan_check.py
+    python query_plan_check.py --database data/bbq_sessions.db
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, select, tuple_
+from sqlalchemy.dialects import sqlite
+
+from app.archive import raw_log_sql
+from app.migrations import run_migrations
+from app.models import BBQSession, Graph, NoteEntry, Temperature
+
+
+def orm_sql(statement):
+    return str(
+        statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    )
+
+
+# (what, SQL, parameters, text the plan must contain)
+CHECKS = [
+    (
+        "Graph, export and archive read of the raw log",
+        raw_log_sql(),
+        (1,),
+        "USING COVERING INDEX ix_temperature_log_session_time",
+    ),
+    (
+        "Raw log read up to a known id",
+        raw_log_sql(through_id=True),
+        (1, 1000),
+        "USING COVERING INDEX ix_temperature_log_session_time",
+    ),
+    (
+        "Live feed rows after the last id sent",
+        raw_log_sql(after_id=True),
+        (1, 1000),
+        "USING INTEGER PRIMARY KEY",
+    ),
+    (
+        "Manual temperatures of a session",
+        orm_sql(
+            select(Temperature)
+            .where(Temperature.session_id == 1)
+            .order_by(Temperature.timestamp)
+        ),
+        (),
+        "USING INDEX ix_temperature_session_time",
+    ),
+    (
+        "Notes of a session",
+        orm_sql(
+            select(NoteEntry)
+            .where(NoteEntry.session_id == 1)
+            .order_by(NoteEntry.timestamp)
+        ),
+        (),
+        "USING INDEX ix_note_entry_session_time",
+    ),
+    (
+        "Uploaded graphs of a session",
+        orm_sql(select(Graph).where(Graph.session_id == 1).order_by(Graph.created_at)),
+        (),
+        "USING INDEX ix_graph_session_created",
+    ),
+    (
+        "Index page after a keyset cursor",
+        orm_sql(
+            select(BBQSession.id, BBQSession.title)
+            .where(tuple_(BBQSession.start_time, BBQSession.id) < ("2025-01-01 00:00:00", 100))
+            .order_by(BBQSession.start_time.desc(), BBQSession.id.desc())
+            .limit(25)
+        ),
+        (),
+        "USING INDEX ix_bbq_session_start_time",
+    ),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--database", help="Check against this database (opened read-only) instead of a fresh one"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.database:
+            connection = sqlite3.connect(f"file:{os.path.abspath(args.database)}?mode=ro", uri=True)
+        else:
+            path = os.path.join(scratch, "plan.db")
+            engine = create_engine(f"sqlite:///{path}")
+            run_migrations(engine)
+            engine.dispose()
+            connection = sqlite3.connect(path)
+
+        failed = False
+        for what, sql, params, expected in CHECKS:
+            plan = [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            ok = any(expected in step for step in plan) and not any(
+                "TEMP B-TREE" in step for step in plan
+            )
+            failed |= not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {what}")
+            for step in plan:
+                print(f"       {step}")
+            if not ok:
+                print(f"       expected: {expected}, without a temporary B-tree")
+        connection.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Replay and load-generator harness for the SmokeNotes MQTT listener
+
+Feeds recorded or synthetic FlameBoss payloads through smokenotes_mqtt.py
+without real hardware, either through an in-process broker stand-in (which
+exercises on_connect, topic subscriptions and a separate network thread like
+paho's) or straight into on_message. Reports sustained throughput, end-to-end
+write latency and database growth.
+
+Examples:
+
+    # 24 controllers, 1 message/sec each, for 60 simulated seconds
+    python smokenotes_mqtt/replay.py --controllers 24 --count 60
+
+    # As fast as possible, straight into on_message
+    python smokenotes_mqtt/replay.py --controllers 48 --count 500 --rate 0 --mode direct
+
+    # Replay a capture (JSON lines of {"topic": ..., "payload": {...}})
+    python smokenotes_mqtt/replay.py --file cook.jsonl --rate 10
+
+    # Two web processes rendering pages against the same database file
+    python smokenotes_mqtt/replay.py --controllers 24 --count 120 --web-readers 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ------------------------------
+# Payloads
+# ------------------------------
+def to_flameboss(fahrenheit):
+    """Inverse of the listener's convert(): °F to FlameBoss tenths of a degree C."""
+    return round((fahrenheit - 32) * 50 / 9)
+
+
+def synthetic_messages(controllers, count, start_sec, disconnect):
+    """Yield (topic, payload) pairs, interleaved one message per controller per second."""
+    pit = {device: random.uniform(220, 260) for device in range(controllers)}
+    meat = {device: random.uniform(40, 60) for device in range(controllers)}
+    for second in range(count):
+        for device in range(controllers):
+            pit[device] += random.uniform(-3, 3)
+            meat[device] = min(meat[device] + random.uniform(0, 0.1), 205)
+            yield f"flameboss/replay-{device}/send/data", {
+                "cook_id": 900000 + device,
+                "sec": start_sec + second,
+                "temps": [to_flameboss(pit[device]), to_flameboss(meat[device]), -32767],
+                "set_temp": to_flameboss(250),
+                "blower": random.randint(0, 10000),
+            }
+    if disconnect:
+        for device in range(controllers):
+            yield f"flameboss/replay-{device}/send/data", {
+                "name": "disconnected",
+                "from": "mqttr-4",
+            }
+
+
+def recorded_messages(path):
+    """Yield (topic, payload) pairs from a JSON-lines capture."""
+    with open(path) as capture:
+        for line in capture:
+            if line.strip():
+                record = json.loads(line)
+                yield record.get("topic", "flameboss/replay/send/data"), record["payload"]
+
+
+# ------------------------------
+# Broker Stand-in
+# ------------------------------
+class LocalBroker:
+    """In-process stand-in for the FlameBoss broker.
+
+    Clients get their own delivery thread, so on_message runs off the
+    publishing thread exactly as it does on paho's network loop.
+    """
+
+    def __init__(self):
+        self.clients = []
+
+    def connect(self, on_connect, on_message):
+        client = LocalClient(on_message)
+        self.clients.append(client)
+        on_connect(client, None, {}, 0, None)
+        client.start()
+        return client
+
+    def publish(self, topic, payload):
+        for client in self.clients:
+            client.deliver(topic, payload)
+
+    def disconnect(self):
+        for client in self.clients:
+            client.stop()
+
+
+class LocalClient:
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.subscriptions = []
+        self.inbox = queue.Queue()
+        self.thread = threading.Thread(target=self.loop, name="local-broker", daemon=True)
+
+    def subscribe(self, topics):
+        if isinstance(topics, str):
+            topics = [(topics, 0)]
+        self.subscriptions.extend(topic for topic, qos in topics)
+
+    def deliver(self, topic, payload):
+        from paho.mqtt.client import topic_matches_sub
+
+        if any(topic_matches_sub(sub, topic) for sub in self.subscriptions):
+            self.inbox.put(SimpleNamespace(topic=topic, payload=payload))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.inbox.put(None)
+        self.thread.join()
+
+    def loop(self):
+        while True:
+            msg = self.inbox.get()
+            if msg is None:
+                return
+            self.on_message(self, None, msg)
+
+
+# ------------------------------
+# Web Readers
+# ------------------------------
+def web_reader(database_path, path, stop, results):
+    """Fetch a page from a separate process until stop is set, recording latencies."""
+    os.environ["DATABASE_PATH"] = database_path
+    sys.path.insert(0, REPO_ROOT)
+    from app import create_app
+
+    client = create_app().test_client()
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 500:
+            print(f"Web reader got {response.status_code} for {path}")
+    results.put(latencies)
+
+
+# ------------------------------
+# Reporting
+# ------------------------------
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def database_size(path):
+    return sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+
+
+def print_latencies(label, latencies):
+    print(
+        f"{label}: p50 {percentile(latencies, 0.50) * 1000:.1f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+        f"max {max(latencies, default=float('nan')) * 1000:.1f} ms "
+        f"({len(latencies)} samples)"
+    )
+
+
+# ------------------------------
+# Run
+# ------------------------------
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("broker", "direct"), default="broker")
+    parser.add_argument("--file", help="JSON-lines capture to replay instead of synthetic data")
+    parser.add_argument("--controllers", type=int, default=8)
+    parser.add_argument("--count", type=int, default=60, help="messages per controller")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="messages/sec per controller (per capture line with --file); 0 is unpaced",
+    )
+    parser.add_argument("--no-disconnect", action="store_true", help="skip disconnected events")
+    parser.add_argument("--database", help="database file (default: a fresh temporary file)")
+    parser.add_argument("--web-readers", type=int, default=0, help="concurrent page-load processes")
+    parser.add_argument("--web-path", default="/", help="page the web readers fetch")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    database_path = args.database or os.path.join(tempfile.mkdtemp(), "replay.db")
+    os.environ["DATABASE_PATH"] = database_path
+    for name in ("MQTT_BROKER", "MQTT_USERNAME", "MQTT_PASSWORD"):
+        os.environ.setdefault(name, "replay")
+    os.environ.setdefault("MQTT_TOPIC", "flameboss/+/send/data")
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    # The web app owns the full schema; create it first when it is importable
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        from app import create_app
+
+        create_app()
+    except ImportError:
+        pass
+
+    import smokenotes_mqtt as listener
+    from sqlalchemy import text
+
+    # Time each reading from publish to commit by wrapping the writer's flush
+    published = {}
+    written = []
+    flush_readings = listener.flush_readings
+
+    def timed_flush(batch):
+        flush_readings(batch)
+        committed = time.perf_counter()
+        for reading in batch:
+            key = (reading["cook_id"], int(reading["timestamp"].timestamp()))
+            if key in published:
+                written.append(committed - published.pop(key))
+
+    listener.flush_readings = timed_flush
+
+    def count_rows():
+        with listener.app.app_context():
+            return listener.db.session.execute(
+                text("SELECT COUNT(*) FROM temperature_log")
+            ).scalar()
+
+    rows_before = count_rows()
+    size_before = database_size(database_path)
+    pipeline = listener.start_pipeline()
+
+    if args.file:
+        messages = recorded_messages(args.file)
+        interval = 1 / args.rate if args.rate else 0
+    else:
+        messages = synthetic_messages(
+            args.controllers, args.count, int(time.time()), not args.no_disconnect
+        )
+        interval = 1 / (args.rate * args.controllers) if args.rate else 0
+
+    if args.mode == "broker":
+        broker = LocalBroker()
+        broker.connect(listener.on_connect, listener.on_message)
+        publish = broker.publish
+    else:
+        def publish(topic, payload):
+            listener.on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+
+    # Spawned, not forked: the listener's threads are already running
+    context = multiprocessing.get_context("spawn")
+    stop_readers = context.Event()
+    reader_results = context.Queue()
+    readers = [
+        context.Process(
+            target=web_reader,
+            args=(database_path, args.web_path, stop_readers, reader_results),
+        )
+        for _ in range(args.web_readers)
+    ]
+    for reader in readers:
+        reader.start()
+
+    # Silence the listener's per-message logging while publishing
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    sent_count = 0
+    started = time.perf_counter()
+    try:
+        for topic, payload in messages:
+            if "sec" in payload:
+                published[(payload.get("cook_id"), int(payload["sec"]))] = time.perf_counter()
+            publish(topic, json.dumps(payload).encode())
+            sent_count += 1
+            if interval:
+                time.sleep(max(0.0, started + sent_count * interval - time.perf_counter()))
+        sent = time.perf_counter()
+        if args.mode == "broker":
+            broker.disconnect()
+        listener.stop_pipeline(pipeline)
+        finished = time.perf_counter()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    stop_readers.set()
+    page_latencies = []
+    for _ in readers:
+        page_latencies.extend(reader_results.get())
+    for reader in readers:
+        reader.join()
+
+    rows_added = count_rows() - rows_before
+    size_added = database_size(database_path) - size_before
+    print(f"Database: {database_path}")
+    print(f"Mode: {args.mode}")
+    print(f"Published {sent_count} messages in {sent - started:.2f} s")
+    print(f"Sustained: {len(written) / (finished - started):.0f} readings/sec written")
+    print_latencies("Publish-to-commit latency", written)
+    print(f"Rows added: {rows_added}")
+    print(f"Database growth: {size_added / 1024:.0f} KiB ({size_added / max(rows_added, 1):.0f} bytes/row)")
+    if page_latencies:
+        print_latencies(f"Page latency for {args.web_path}", page_latencies)
+
+
+if __name__ == "__main__":
+    main()
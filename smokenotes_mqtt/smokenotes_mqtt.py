@@ -1,14 +1,30 @@
 import paho.mqtt.client as mqtt
+import heapq
+import itertools
 import json
 import os
+import queue
+import sys
 import threading
+import time
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from zoneinfo import ZoneInfo
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql import func
 
+try:
+    # The image ships app/migrations.py, rollups.py and sqlite_utils.py next to this file
+    from migrations import run_migrations
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+    from migrations import run_migrations
+from rollups import ROLLUP_CHANNELS, ROLLUP_UPSERT_SQL, aggregate_rollups
+from sqlite_utils import configure_sqlite_engine
+
 # ------------------------------
 # Configuration
 # ------------------------------
@@ -16,8 +32,48 @@ MQTT_BROKER = os.environ["MQTT_BROKER"]
 MQTT_PORT = 1883
 MQTT_USERNAME = os.environ["MQTT_USERNAME"]
 MQTT_PASSWORD = os.environ["MQTT_PASSWORD"]
-MQTT_TOPIC = os.environ["MQTT_TOPIC"]
+# Comma-separated list of topics; MQTT wildcards such as flameboss/+/send/data work
+MQTT_TOPICS = [t.strip() for t in os.environ["MQTT_TOPIC"].split(",") if t.strip()]
 DATABASE_URI = os.environ.get("DATABASE_PATH", "/app/data/bbq_sessions.db")
+# Write-behind ingest: readings are flushed every N rows or M milliseconds
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "50"))
+INGEST_FLUSH_MS = int(os.environ.get("INGEST_FLUSH_MS", "1000"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "10000"))
+# Readings that cannot reach the database are appended here and replayed later
+INGEST_SPOOL_PATH = os.environ.get(
+    "INGEST_SPOOL_PATH",
+    os.path.join(os.path.dirname(DATABASE_URI), "ingest_spool.jsonl"),
+)
+INGEST_SPOOL_REPLAY_ROWS = int(os.environ.get("INGEST_SPOOL_REPLAY_ROWS", "1000"))
+INGEST_SPOOL_RETRY_SECONDS = int(os.environ.get("INGEST_SPOOL_RETRY_SECONDS", "5"))
+# Readings the database rejects outright (not just locked or down) are moved here
+INGEST_DEAD_LETTER_PATH = os.environ.get(
+    "INGEST_DEAD_LETTER_PATH",
+    os.path.join(os.path.dirname(DATABASE_URI), "ingest_dead_letter.jsonl"),
+)
+# Messages are handled by a fixed pool of workers, each cook pinned to one worker
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "4"))
+if INGEST_WORKERS < 1:
+    # Messages are routed by hash(cook_id) % INGEST_WORKERS
+    sys.exit(f"INGEST_WORKERS must be at least 1, not {INGEST_WORKERS}")
+# Deadband storage, e.g. "pit_temp=2,meat_temp1=1,blower=5": a log row is stored
+# only when a channel moves more than its tolerance (channels not listed store on
+# any change) or INGEST_HEARTBEAT_SECONDS have passed. Empty stores every message.
+INGEST_DEADBAND = {
+    channel.strip(): float(tolerance)
+    for channel, tolerance in (
+        item.split("=", 1)
+        for item in os.environ.get("INGEST_DEADBAND", "").split(",")
+        if item.strip()
+    )
+}
+INGEST_HEARTBEAT_SECONDS = int(os.environ.get("INGEST_HEARTBEAT_SECONDS", "60"))
+# Prometheus-style metrics are served on http://<host>:METRICS_PORT/metrics; 0 disables
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# Seconds after a disconnect before the session is ended
+DISCONNECT_GRACE_SECONDS = int(os.environ.get("DISCONNECT_GRACE_SECONDS", "300"))
+# Seconds between snapshots of the latest temps into the Temperature table
+PERSIST_INTERVAL_SECONDS = int(os.environ.get("PERSIST_INTERVAL_SECONDS", "900"))
 
 # ------------------------------
 # Flask + SQLAlchemy Setup
@@ -29,6 +85,11 @@ db = SQLAlchemy(app)
 os.makedirs("data", exist_ok=True)
 
 
+# Same pragmas as the web app, which shares the database file
+with app.app_context():
+    configure_sqlite_engine(db.engine)
+
+
 # ------------------------------
 # Models
 # ------------------------------
@@ -44,7 +105,7 @@ class BBQSession(db.Model):
 class TemperatureLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cook_id = db.Column(db.Integer, index=True)
-    session_id = db.Column(db.Integer, db.ForeignKey("b_b_q_session.id"), nullable=True)
+    session_id = db.Column(db.Integer, db.ForeignKey("bbq_session.id"), nullable=True)
     #timestamp = db.Column(db.DateTime, server_default=func.now())
     timestamp = db.Column(db.DateTime(timezone=True), server_default=func.now())
     set_temp = db.Column(db.Float)
@@ -66,9 +127,310 @@ class Temperature(db.Model):
 # ------------------------------
 # Globals for Tracking State
 # ------------------------------
-disconnection_timers = {}  # cook_id: Timer
 latest_temps = {}  # cook_id: {"meat": val, "smoker": val}
-last_seen_cook_id = {}  # "latest": cook_id
+last_seen_cook_id = {}  # device_id: cook_id
+# cook_id: last target_temp written to bbq_session; only the ingest writer touches it
+known_sessions = {}
+deadband_state = {}  # cook_id: last reading stored to temperature_log
+# Parsed readings, and (_FORGET_COOK, cook_id) for cooks that ended
+ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+worker_queues = [queue.Queue(maxsize=INGEST_QUEUE_SIZE) for _ in range(INGEST_WORKERS)]
+_STOP = object()
+_FORGET_COOK = object()
+spool_lock = threading.Lock()
+spool_state = {"depth": 0, "spooled": 0, "replayed": 0}  # counts of readings
+scheduled_jobs = []  # heap of (run_at, seq, key)
+pending_jobs = {}  # key: (run_at, seq, func, interval)
+scheduler_cv = threading.Condition()
+scheduler_seq = itertools.count()
+scheduler_state = {"stopping": False}
+metrics_lock = threading.Lock()
+message_counts = {"received": {}, "stored": {}, "dropped": {}}  # (cook_id, reason): count
+device_last_seen = {}  # device_id: Unix time of the last message
+
+
+# ------------------------------
+# Metrics
+# ------------------------------
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus exposition layout."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        with metrics_lock:
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+parse_latency = Histogram(
+    "smokenotes_parse_seconds", "Time to turn a FlameBoss message into a reading"
+)
+commit_latency = Histogram(
+    "smokenotes_db_commit_seconds", "Time to write and commit one batch of readings"
+)
+
+
+def count_message(kind, cook_id, reason=None, amount=1):
+    key = (cook_id, reason)
+    with metrics_lock:
+        counts = message_counts[kind]
+        counts[key] = counts.get(key, 0) + amount
+
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    now = time.time()
+    lines = []
+    with metrics_lock:
+        for kind, description in (
+            ("received", "Messages received per cook"),
+            ("stored", "Readings stored as temperature_log rows per cook"),
+            ("dropped", "Messages or readings not stored, per cook and reason"),
+        ):
+            name = f"smokenotes_messages_{kind}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for (cook_id, reason), count in sorted(
+                message_counts[kind].items(), key=str
+            ):
+                labels = f'cook_id="{cook_id or ""}"'
+                if reason:
+                    labels += f',reason="{reason}"'
+                lines.append(f"{name}{{{labels}}} {count}")
+        histograms = parse_latency.render() + commit_latency.render()
+    lines += histograms
+
+    pending_deadlines = sum(
+        1 for key in list(pending_jobs) if isinstance(key, tuple) and key[0] == "end_session"
+    )
+    gauges = [
+        ("smokenotes_ingest_queue_depth", "Readings waiting for the writer", ingest_queue.qsize()),
+        (
+            "smokenotes_worker_queue_depth",
+            "Messages waiting for the message workers",
+            sum(worker_queue.qsize() for worker_queue in worker_queues),
+        ),
+        ("smokenotes_spool_depth", "Readings waiting in the disk spool", spool_state["depth"]),
+        ("smokenotes_active_cooks", "Cooks seen that have not ended", len(known_sessions)),
+        (
+            "smokenotes_pending_disconnect_timers",
+            "Cooks waiting out the disconnect grace period",
+            pending_deadlines,
+        ),
+    ]
+    for name, description, value in gauges:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, description, value in (
+        ("smokenotes_spooled_total", "Readings written to the disk spool", spool_state["spooled"]),
+        ("smokenotes_replayed_total", "Spooled readings replayed into the database", spool_state["replayed"]),
+    ):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter", f"{name} {value}"]
+
+    name = "smokenotes_seconds_since_last_message"
+    lines += [f"# HELP {name} Seconds since each device last published", f"# TYPE {name} gauge"]
+    for device_id, last_seen in sorted(device_last_seen.items()):
+        lines.append(f'{name}{{device_id="{device_id}"}} {now - last_seen:.3f}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown out the listener's own output
+
+
+def start_metrics_server():
+    """Serve /metrics from a daemon thread; returns None when METRICS_PORT is 0."""
+    if not METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on port {METRICS_PORT}")
+    return server
+
+
+# ------------------------------
+# Scheduler
+# ------------------------------
+def schedule(key, delay, func, interval=None):
+    """Run func on the scheduler thread after delay seconds.
+
+    Scheduling a key that is already pending replaces the earlier job. With an
+    interval the job is re-armed every interval seconds.
+    """
+    with scheduler_cv:
+        run_at = time.time() + delay
+        seq = next(scheduler_seq)
+        pending_jobs[key] = (run_at, seq, func, interval)
+        heapq.heappush(scheduled_jobs, (run_at, seq, key))
+        scheduler_cv.notify()
+
+
+def cancel_scheduled(key):
+    """Cancel a pending job. Returns True if one was pending."""
+    with scheduler_cv:
+        return pending_jobs.pop(key, None) is not None
+
+
+def scheduler_loop():
+    """Sleep until the earliest deadline, run it, repeat."""
+    while True:
+        with scheduler_cv:
+            while True:
+                if scheduler_state["stopping"]:
+                    return
+                if not scheduled_jobs:
+                    scheduler_cv.wait()
+                    continue
+                run_at, seq, key = scheduled_jobs[0]
+                job = pending_jobs.get(key)
+                if job is None or job[1] != seq:
+                    # Cancelled or replaced; drop the stale heap entry
+                    heapq.heappop(scheduled_jobs)
+                    continue
+                delay = run_at - time.time()
+                if delay > 0:
+                    scheduler_cv.wait(delay)
+                    continue
+                heapq.heappop(scheduled_jobs)
+                del pending_jobs[key]
+                break
+
+        func, interval = job[2], job[3]
+        if interval is not None:
+            schedule(key, interval, func, interval)
+        try:
+            func()
+        except Exception as e:
+            print(f"Error running scheduled job {key}:", e)
+
+
+def start_scheduler():
+    scheduler = threading.Thread(target=scheduler_loop, name="scheduler", daemon=True)
+    scheduler.start()
+    return scheduler
+
+
+def stop_scheduler(scheduler):
+    with scheduler_cv:
+        scheduler_state["stopping"] = True
+        scheduler_cv.notify()
+    scheduler.join()
+
+
+# ------------------------------
+# End-of-cook Deadlines
+# ------------------------------
+def schedule_end_of_cook(cook_id, end_after):
+    schedule(
+        ("end_session", cook_id),
+        max(0.0, end_after - time.time()),
+        lambda: end_session(cook_id),
+    )
+
+
+def start_disconnect_deadline(cook_id):
+    """Persist and schedule the end of a cook whose controller disconnected."""
+    end_after = time.time() + DISCONNECT_GRACE_SECONDS
+    with app.app_context():
+        db.session.execute(
+            text(
+                """
+                INSERT INTO cook_deadline (cook_id, end_after) VALUES (:cook_id, :end_after)
+                ON CONFLICT(cook_id) DO UPDATE SET end_after = excluded.end_after
+            """
+            ),
+            {"cook_id": cook_id, "end_after": end_after},
+        )
+        db.session.commit()
+    schedule_end_of_cook(cook_id, end_after)
+
+
+def cancel_disconnect_deadline(cook_id):
+    """Cancel a pending end-of-cook deadline. Returns True if one was pending."""
+    if not cancel_scheduled(("end_session", cook_id)):
+        return False
+    with app.app_context():
+        db.session.execute(
+            text("DELETE FROM cook_deadline WHERE cook_id = :cook_id"),
+            {"cook_id": cook_id},
+        )
+        db.session.commit()
+    return True
+
+
+def end_session(cook_id):
+    """Set end_time on the session and forget everything held for the cook."""
+    with app.app_context():
+        now = datetime.now(ZoneInfo("UTC"))
+        db.session.execute(
+            text("UPDATE bbq_session SET end_time = :end_time WHERE id = :cook_id"),
+            {"end_time": now, "cook_id": cook_id},
+        )
+        db.session.execute(
+            text("DELETE FROM cook_deadline WHERE cook_id = :cook_id"),
+            {"cook_id": cook_id},
+        )
+        db.session.commit()
+        print(f"Set end_time for session {cook_id} at {now}")
+
+    latest_temps.pop(cook_id, None)
+    # The writer drops it after the readings queued ahead, so a batch
+    # committing now cannot put it back
+    ingest_queue.put((_FORGET_COOK, cook_id))
+    deadband_state.pop(cook_id, None)
+    with metrics_lock:
+        for counts in message_counts.values():
+            for key in [key for key in counts if key[0] == cook_id]:
+                del counts[key]
+    for device_id, last_cook_id in list(last_seen_cook_id.items()):
+        if last_cook_id == cook_id:
+            last_seen_cook_id.pop(device_id, None)
+
+
+def restore_disconnect_deadlines():
+    """Re-arm deadlines left by a previous run; overdue ones fire right away."""
+    with app.app_context():
+        deadlines = db.session.execute(
+            text("SELECT cook_id, end_after FROM cook_deadline")
+        ).fetchall()
+    for cook_id, end_after in deadlines:
+        schedule_end_of_cook(cook_id, end_after)
+    if deadlines:
+        print(f"Restored {len(deadlines)} pending end-of-cook deadlines")
 
 
 # ------------------------------
@@ -78,59 +440,66 @@ def on_connect(client, userdata, flags, reason_code, properties):
     """Callback for when the client receives a CONNACK response from the server."""
     if reason_code == 0:
         print("Connected to MQTT broker successfully")
-        client.subscribe(MQTT_TOPIC)
+        client.subscribe([(topic, 0) for topic in MQTT_TOPICS])
+        print(f"Subscribed to {', '.join(MQTT_TOPICS)}")
     else:
         print(f"Failed to connect to MQTT broker with reason code: {reason_code}")
 
 
-def on_message(client, userdata, msg):
-    global disconnection_timers, last_seen_cook_id, latest_temps
+def device_from_topic(topic):
+    """Return the device id from a flameboss/<device_id>/... topic."""
+    parts = topic.split("/")
+    if len(parts) > 1 and parts[0] == "flameboss":
+        return parts[1]
+    return topic
+
 
+def on_message(client, userdata, msg):
+    """Route a message to the worker that owns its cook, keeping each cook in order."""
     try:
         payload = json.loads(msg.payload.decode())
         print(f"Received payload: {payload}")
+    except Exception as e:
+        print("Error decoding MQTT message:", e)
+        count_message("dropped", None, "decode_error")
+        return
+
+    device_id = device_from_topic(msg.topic)
+    device_last_seen[device_id] = time.time()
+    cook_id = payload.get("cook_id")
+    if cook_id:
+        last_seen_cook_id[device_id] = cook_id
+    else:
+        # Disconnect events may omit cook_id; use this device's current cook
+        cook_id = last_seen_cook_id.get(device_id)
+    if not cook_id:
+        print(f"No cook_id available for device {device_id}. Skipping.")
+        count_message("dropped", None, "no_cook_id")
+        return
 
-        # Handle disconnect message
-        if payload.get("name") == "disconnected" and payload.get("from") == "mqttr-4":
-            cook_id = payload.get("cook_id") or last_seen_cook_id.get("latest")
-            if not cook_id:
-                print("No cook_id available for disconnection.")
-                return
-
-            def set_end_time():
-                with app.app_context():
-                    now = datetime.now(ZoneInfo("UTC"))
-                    db.session.execute(
-                        text(
-                            "UPDATE bbq_session SET end_time = :end_time WHERE id = :cook_id"
-                        ),
-                        {"end_time": now, "cook_id": cook_id},
-                    )
-                    db.session.commit()
-                    print(f"Set end_time for session {cook_id} at {now}")
+    count_message("received", cook_id)
+    worker_queues[hash(cook_id) % INGEST_WORKERS].put((device_id, cook_id, payload))
 
-            if cook_id in disconnection_timers:
-                disconnection_timers[cook_id].cancel()
 
-            timer = threading.Timer(300, set_end_time)
-            disconnection_timers[cook_id] = timer
-            timer.start()
+def handle_message(device_id, cook_id, payload):
+    """Process one decoded FlameBoss message on the worker that owns cook_id."""
+    try:
+        # Handle disconnect message
+        if payload.get("name") == "disconnected" and payload.get("from") == "mqttr-4":
+            start_disconnect_deadline(cook_id)
             print(f"Disconnection timer started for cook_id {cook_id}")
             return
 
         # Standard temp message
-        cook_id = payload.get("cook_id")
-        if not cook_id:
-            print("No cook_id in message. Skipping.")
+        if not payload.get("cook_id"):
+            print(f"No cook_id in message from device {device_id}. Skipping.")
+            count_message("dropped", cook_id, "no_cook_id")
             return
 
-        last_seen_cook_id["latest"] = cook_id
-
-        if cook_id in disconnection_timers:
-            disconnection_timers[cook_id].cancel()
-            del disconnection_timers[cook_id]
+        if cancel_disconnect_deadline(cook_id):
             print(f"Disconnection timer cancelled for cook_id {cook_id}")
 
+        parse_started = time.perf_counter()
         timestamp = datetime.fromtimestamp(payload["sec"], tz=ZoneInfo("UTC"))
 
         temps = payload.get("temps", [])
@@ -151,71 +520,410 @@ def on_message(client, userdata, msg):
         if meat_temp1 is not None or pit_temp is not None:
             latest_temps[cook_id] = {"meat": meat_temp1, "smoker": pit_temp}
 
-        with app.app_context():
-            result = db.session.execute(
-                text("SELECT id FROM bbq_session WHERE id = :cook_id"),
-                {"cook_id": cook_id},
-            ).fetchone()
+        reading = {
+            "cook_id": cook_id,
+            "session_id": cook_id,
+            "timestamp": timestamp,
+            "set_temp": set_temp,
+            "pit_temp": pit_temp,
+            "meat_temp1": meat_temp1,
+            "blower": blower,
+        }
+        # Readings inside the deadband still feed the rollups, just not temperature_log
+        reading["store"] = passes_deadband(reading)
+        if not reading["store"]:
+            count_message("dropped", cook_id, "deadband")
+        parse_latency.observe(time.perf_counter() - parse_started)
+        enqueue_reading(reading)
 
-            if not result:
-                db.session.execute(
-                    text(
-                        """
-                        INSERT INTO bbq_session (id, title, meat_type, start_time, target_temp) 
-                        VALUES (:id, :title, :meat_type, :start_time, :target_temp)
-                    """
-                    ),
-                    {
-                        "id": cook_id,
-                        "title": f"BBQ Session {cook_id} from flameboss",
-                        "meat_type": "Unknown",
-                        "start_time": timestamp,
-                        "target_temp": set_temp if set_temp else 0,
-                    },
-                )
-                db.session.commit()
-                print(f"Created new BBQ session with ID {cook_id}")
-            # Update target_temp in bbq_session if set_temp has changed
-            elif set_temp is not None:
+    except Exception as e:
+        print("Error processing MQTT message:", e)
+        count_message("dropped", cook_id, "error")
+
+
+# ------------------------------
+# Write-behind Ingest
+# ------------------------------
+def message_worker(worker_queue):
+    """Handle messages for the cooks hashed to this worker, in arrival order."""
+    while True:
+        item = worker_queue.get()
+        if item is _STOP:
+            return
+        handle_message(*item)
+
+
+def start_message_workers():
+    workers = []
+    for index, worker_queue in enumerate(worker_queues):
+        worker = threading.Thread(
+            target=message_worker,
+            args=(worker_queue,),
+            name=f"message-worker-{index}",
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+def stop_message_workers(workers):
+    """Let the workers finish queued messages, then wait for them to exit."""
+    for worker_queue in worker_queues:
+        worker_queue.put(_STOP)
+    for worker in workers:
+        worker.join()
+
+
+def passes_deadband(reading):
+    """Decide whether a reading is stored as a temperature_log row.
+
+    Runs on the worker that owns the cook, so deadband_state needs no lock.
+    """
+    if not INGEST_DEADBAND:
+        return True
+    last = deadband_state.get(reading["cook_id"])
+    store = (
+        last is None
+        or (reading["timestamp"] - last["timestamp"]).total_seconds()
+        >= INGEST_HEARTBEAT_SECONDS
+    )
+    for channel in ROLLUP_CHANNELS:
+        if store:
+            break
+        new, old = reading[channel], last[channel]
+        if new is None or old is None:
+            store = new is not old
+        else:
+            store = abs(new - old) > INGEST_DEADBAND.get(channel, 0)
+    if store:
+        deadband_state[reading["cook_id"]] = reading
+    return store
+
+
+def enqueue_reading(reading):
+    """Hand a parsed reading to the writer thread without touching the database."""
+    try:
+        ingest_queue.put_nowait(reading)
+    except queue.Full:
+        # The writer is stuck behind the database; keep the reading on disk instead
+        spool_readings([reading])
+
+
+def ensure_sessions(batch):
+    """Upsert bbq_session rows for cooks that are new or whose set point changed.
+
+    Returns the cache entries to record once the transaction commits.
+    """
+    first_seen = {}
+    latest_set_temp = {}
+    for reading in batch:
+        first_seen.setdefault(reading["cook_id"], reading)
+        if reading["set_temp"] is not None:
+            latest_set_temp[reading["cook_id"]] = reading["set_temp"]
+
+    updates = {}
+    for cook_id, reading in first_seen.items():
+        set_temp = latest_set_temp.get(cook_id)
+        if cook_id in known_sessions and (
+            set_temp is None or known_sessions[cook_id] == set_temp
+        ):
+            continue
+
+        db.session.execute(
+            text(
+                """
+                INSERT INTO bbq_session (id, title, meat_type, start_time, target_temp) 
+                VALUES (:id, :title, :meat_type, :start_time, :target_temp)
+                ON CONFLICT(id) DO UPDATE SET target_temp = excluded.target_temp
+                WHERE :set_temp IS NOT NULL
+                AND bbq_session.target_temp IS NOT excluded.target_temp
+            """
+            ),
+            {
+                "id": cook_id,
+                "title": f"BBQ Session {cook_id} from flameboss",
+                "meat_type": "Unknown",
+                "start_time": reading["timestamp"],
+                "target_temp": set_temp or 0,
+                "set_temp": set_temp,
+            },
+        )
+        if cook_id not in known_sessions:
+            print(f"Registered BBQ session with ID {cook_id}")
+        else:
+            print(f"Updated target temperature for session {cook_id} to {set_temp}°F")
+        updates[cook_id] = (
+            set_temp if set_temp is not None else known_sessions.get(cook_id)
+        )
+    return updates
+
+
+def write_batch(batch):
+    """Write a batch of readings to temperature_log as a single transaction.
+
+    Returns False if the database could not take the batch (locked, down, out
+    of disk); any other error, such as a constraint a reading breaks, is
+    raised after the rollback.
+    """
+    with app.app_context():
+        try:
+            commit_started = time.perf_counter()
+            session_updates = ensure_sessions(batch)
+            # A list of parameter sets is run as one executemany() call
+            log_rows = [reading for reading in batch if reading["store"]]
+            if log_rows:
                 db.session.execute(
                     text(
                         """
-                        UPDATE bbq_session 
-                        SET target_temp = :target_temp
-                        WHERE id = :cook_id
+                        INSERT INTO temperature_log 
+                        (cook_id, session_id, timestamp, set_temp, pit_temp, meat_temp1, blower) 
+                        VALUES (:cook_id, :session_id, :timestamp, :set_temp, :pit_temp, :meat_temp1, :blower)
                     """
                     ),
-                    {
-                        "target_temp": set_temp,
-                        "cook_id": cook_id,
-                    },
+                    log_rows,
                 )
-                db.session.commit()
-                print(f"Updated target temperature for session {cook_id} to {set_temp}°F")
-
+            # Keep the 1 and 15 minute rollups current in the same transaction;
+            # they take every reading, even those the deadband kept out of the log
+            rollups = aggregate_rollups(batch)
+            db.session.execute(ROLLUP_UPSERT_SQL, rollups)
+            # Lets the web app's graph cache see the new rows and rollups
             db.session.execute(
-                text(
-                    """
-                    INSERT INTO temperature_log 
-                    (cook_id, session_id, timestamp, set_temp, pit_temp, meat_temp1, blower) 
-                    VALUES (:cook_id, :session_id, :timestamp, :set_temp, :pit_temp, :meat_temp1, :blower)
-                """
-                ),
-                {
-                    "cook_id": cook_id,
-                    "session_id": cook_id,
-                    "timestamp": timestamp,
-                    "set_temp": set_temp,
-                    "pit_temp": pit_temp,
-                    "meat_temp1": meat_temp1,
-                    "blower": blower,
-                },
+                text("UPDATE bbq_session SET log_version = log_version + 1 WHERE id = :id"),
+                [{"id": session_id} for session_id in {bucket["session_id"] for bucket in rollups}],
             )
             db.session.commit()
-            print(f"Stored log at {timestamp}")
-
+            commit_latency.observe(time.perf_counter() - commit_started)
+            known_sessions.update(session_updates)
+            for reading in log_rows:
+                count_message("stored", reading["cook_id"])
+            print(
+                f"Stored {len(log_rows)} of {len(batch)} readings up to {batch[-1]['timestamp']}"
+            )
+            return True
+        except OperationalError as e:
+            db.session.rollback()
+            print(f"Error writing {len(batch)} log rows:", e)
+            return False
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def store_batch(batch):
+    """Write a batch, retrying it a reading at a time if the database rejects it.
+
+    Readings that still fail are dead-lettered, so one bad reading cannot hold
+    the spool, and every batch queued behind it, forever. Returns False, with
+    nothing written, if the database could not take the batch.
+    """
+    try:
+        return write_batch(batch)
     except Exception as e:
-        print("Error processing MQTT message:", e)
+        print(f"Error writing {len(batch)} log rows, retrying one at a time:", e)
+    for i, reading in enumerate(batch):
+        try:
+            if not write_batch([reading]):
+                # Unavailable part way through; the rest waits in the spool
+                spool_readings(batch[i:])
+                return True
+        except Exception as e:
+            dead_letter_reading(reading, e)
+    return True
+
+
+def flush_readings(batch):
+    """Write a batch, or spool it to disk if the database cannot take it."""
+    if not batch:
+        return
+    # While older readings sit in the spool, newer ones queue up behind them
+    if spool_state["depth"] or not store_batch(batch):
+        spool_readings(batch)
+
+
+def ingest_writer():
+    """Drain the ingest queue, flushing every INGEST_BATCH_SIZE rows or INGEST_FLUSH_MS.
+
+    When the spool holds readings, it is replayed a chunk at a time between
+    batches, backing off INGEST_SPOOL_RETRY_SECONDS while the database is down.
+    """
+    batch = []
+    deadline = None
+    next_replay = 0.0
+    while True:
+        if spool_state["depth"] and not batch and time.monotonic() >= next_replay:
+            if not replay_spool_chunk():
+                next_replay = time.monotonic() + INGEST_SPOOL_RETRY_SECONDS
+
+        timeout = None if not batch else max(0.0, deadline - time.monotonic())
+        if spool_state["depth"]:
+            retry = max(0.0, next_replay - time.monotonic())
+            timeout = retry if timeout is None else min(timeout, retry)
+        try:
+            item = ingest_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        if item is _STOP:
+            flush_readings(batch)
+            return
+        if isinstance(item, tuple) and item[0] is _FORGET_COOK:
+            flush_readings(batch)
+            batch = []
+            known_sessions.pop(item[1], None)
+            continue
+        if item is not None:
+            if not batch:
+                deadline = time.monotonic() + INGEST_FLUSH_MS / 1000
+            batch.append(item)
+
+        if batch and (
+            len(batch) >= INGEST_BATCH_SIZE or time.monotonic() >= deadline
+        ):
+            flush_readings(batch)
+            batch = []
+
+
+# ------------------------------
+# Ingest Spool
+# ------------------------------
+SPOOL_REPLAY_PATH = INGEST_SPOOL_PATH + ".replaying"
+SPOOL_OFFSET_PATH = INGEST_SPOOL_PATH + ".offset"
+
+
+def encode_reading(reading):
+    return json.dumps({**reading, "timestamp": reading["timestamp"].timestamp()})
+
+
+def decode_reading(line):
+    reading = json.loads(line)
+    reading["timestamp"] = datetime.fromtimestamp(reading["timestamp"], tz=ZoneInfo("UTC"))
+    return reading
+
+
+def spool_readings(readings):
+    """Append readings to the spool file with one fsync per call."""
+    with spool_lock:
+        with open(INGEST_SPOOL_PATH, "a") as spool:
+            spool.write("".join(encode_reading(reading) + "\n" for reading in readings))
+            spool.flush()
+            os.fsync(spool.fileno())
+        spool_state["depth"] += len(readings)
+        spool_state["spooled"] += len(readings)
+        print(f"Spooled {len(readings)} readings ({spool_state['depth']} pending)")
+
+
+def dead_letter_reading(reading, error):
+    """Append a reading the database rejected to the dead-letter file.
+
+    Lines use the spool's format, so once the cause is fixed they can be
+    appended to the spool to be replayed. Values JSON cannot hold are written
+    as their repr rather than losing the line.
+    """
+    print(f"Dead-lettering reading for cook {reading['cook_id']}:", error)
+    line = json.dumps(
+        reading,
+        default=lambda value: value.timestamp() if isinstance(value, datetime) else repr(value),
+    )
+    with open(INGEST_DEAD_LETTER_PATH, "a") as dead_letter:
+        dead_letter.write(line + "\n")
+        dead_letter.flush()
+        os.fsync(dead_letter.fileno())
+    count_message("dropped", reading["cook_id"], "dead_letter")
+
+
+def read_spool_offset():
+    try:
+        with open(SPOOL_OFFSET_PATH) as offset_file:
+            return int(offset_file.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_spool_offset(offset):
+    with open(SPOOL_OFFSET_PATH + ".tmp", "w") as offset_file:
+        offset_file.write(str(offset))
+        offset_file.flush()
+        os.fsync(offset_file.fileno())
+    os.replace(SPOOL_OFFSET_PATH + ".tmp", SPOOL_OFFSET_PATH)
+
+
+def replay_spool_chunk():
+    """Write the next INGEST_SPOOL_REPLAY_ROWS spooled readings in one transaction.
+
+    The spool is moved aside before replay so new readings can keep being
+    appended. Progress is recorded after each commit, so a restart resumes
+    where the last replay stopped. Returns False if the database is still
+    unavailable.
+    """
+    with spool_lock:
+        if not os.path.exists(SPOOL_REPLAY_PATH):
+            if not os.path.exists(INGEST_SPOOL_PATH):
+                spool_state["depth"] = 0
+                return True
+            os.replace(INGEST_SPOOL_PATH, SPOOL_REPLAY_PATH)
+            write_spool_offset(0)
+
+    with open(SPOOL_REPLAY_PATH) as spool:
+        offset = read_spool_offset()
+        spool.seek(offset)
+        lines = []
+        while len(lines) < INGEST_SPOOL_REPLAY_ROWS:
+            line = spool.readline()
+            # End of file, or a line cut short by a crash mid-append
+            if not line.endswith("\n"):
+                break
+            lines.append(line)
+            offset = spool.tell()
+        finished = len(lines) < INGEST_SPOOL_REPLAY_ROWS or not spool.readline()
+
+    batch = []
+    for line in lines:
+        try:
+            batch.append(decode_reading(line))
+        except ValueError as e:
+            print("Skipping unreadable spooled reading:", e)
+            count_message("dropped", None, "unreadable_spool")
+    if batch and not store_batch(batch):
+        return False
+
+    if finished:
+        os.remove(SPOOL_REPLAY_PATH)
+        os.remove(SPOOL_OFFSET_PATH)
+    else:
+        write_spool_offset(offset)
+    with spool_lock:
+        spool_state["depth"] = max(0, spool_state["depth"] - len(lines))
+        spool_state["replayed"] += len(batch)
+    print(f"Replayed {len(batch)} spooled readings ({spool_state['depth']} pending)")
+    return True
+
+
+def load_spool_state():
+    """Count readings left in the spool by a previous run."""
+    depth = 0
+    if os.path.exists(SPOOL_REPLAY_PATH):
+        with open(SPOOL_REPLAY_PATH) as spool:
+            spool.seek(read_spool_offset())
+            depth += sum(1 for line in spool if line.endswith("\n"))
+    if os.path.exists(INGEST_SPOOL_PATH):
+        with open(INGEST_SPOOL_PATH) as spool:
+            depth += sum(1 for line in spool if line.endswith("\n"))
+    spool_state["depth"] = depth
+    if depth:
+        print(f"Found {depth} spooled readings to replay")
+
+
+def start_ingest_writer():
+    writer = threading.Thread(target=ingest_writer, name="ingest-writer", daemon=True)
+    writer.start()
+    return writer
+
+
+def stop_ingest_writer(writer):
+    """Flush whatever is still queued and wait for the writer to exit."""
+    ingest_queue.put(_STOP)
+    writer.join()
 
 
 # ------------------------------
@@ -225,7 +933,7 @@ def persist_latest_temps():
     with app.app_context():
         now = datetime.now(ZoneInfo("UTC")).replace(tzinfo=None)
         count = 0
-        for session_id, temps in latest_temps.items():
+        for session_id, temps in list(latest_temps.items()):
             # Check if session is still active (no end_time)
             result = db.session.execute(
                 text("SELECT end_time FROM bbq_session WHERE id = :session_id"),
@@ -245,20 +953,47 @@ def persist_latest_temps():
         db.session.commit()
         print(f"[{now}] Persisted temperatures for {count} active sessions.")
 
-    threading.Timer(900, persist_latest_temps).start() # Update Temperature Log every 15 minutes
-
 
 # ------------------------------
 # Run Listener
 # ------------------------------
-if __name__ == "__main__":
+def start_pipeline():
+    """Migrate the schema and start the scheduler, writer and message workers."""
     with app.app_context():
-        db.create_all()
-    persist_latest_temps()
+        run_migrations(db.engine)
+    scheduler = start_scheduler()
+    restore_disconnect_deadlines()
+    # Update Temperature Log every 15 minutes
+    schedule(
+        "persist_latest_temps",
+        0,
+        persist_latest_temps,
+        interval=PERSIST_INTERVAL_SECONDS,
+    )
+    load_spool_state()
+    writer = start_ingest_writer()
+    workers = start_message_workers()
+    start_metrics_server()
+    return scheduler, writer, workers
+
+
+def stop_pipeline(pipeline):
+    """Drain queued messages and readings, then stop every background thread."""
+    scheduler, writer, workers = pipeline
+    stop_message_workers(workers)
+    stop_ingest_writer(writer)
+    stop_scheduler(scheduler)
+
+
+if __name__ == "__main__":
+    pipeline = start_pipeline()
 
     client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
     client.on_connect = on_connect
     client.on_message = on_message
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    client.loop_forever()
+    try:
+        client.loop_forever()
+    finally:
+        stop_pipeline(pipeline)
@@ -0,0 +1,78 @@
+"""
+Report how long a web worker takes to import and build the app
+
+Runs `python -X importtime -c "import run"` the way a gunicorn worker loads
+the app (schema already migrated by the master) and prints the wall time,
+the slowest imports, and any heavy module that got loaded. Exits non-zero
+if the import took longer than --budget-ms or a heavy module was imported,
+so it can guard boot latency in CI or on the target host:
+
+    python startup_report.py --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Only the render workers and graph/CSV code paths should load these
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib", "PIL")
+
+
+def measure(env):
+    """One cold `import run`; returns wall seconds and {module: (self_us, cumulative_us)}"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import run"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to time")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail above this median wall time")
+    args = parser.parse_args()
+
+    env = dict(os.environ, SCHEMA_MIGRATED="1")
+    env.setdefault("DATABASE_PATH", os.path.abspath("data/bbq_sessions.db"))
+    runs = [measure(env) for _ in range(args.runs)]
+    wall_ms = statistics.median(elapsed for elapsed, _ in runs) * 1000
+    modules = runs[-1][1]
+
+    print(f"Worker start (import run, {args.runs} runs): median {wall_ms:.0f} ms")
+    print("\nSlowest imports by self time (last run):")
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_us, cumulative_us) in slowest[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    failed = False
+    if heavy:
+        print(f"\nHeavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if args.budget_ms is not None and wall_ms > args.budget_ms:
+        print(f"\nOver budget: {wall_ms:.0f} ms > {args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()